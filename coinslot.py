@@ -7,83 +7,132 @@ import threading
 import requests
 import json
 import os
+import collections
+import socket
 from datetime import datetime
-from RPLCD.i2c import CharLCD  # Add LCD library
+import smbus
+from lcd_transport import BatchedLCD  # Batched I2C LCD driver
+from state_store import StateStore
+from ringlog import RingLogger
+from firebase_tx import transaction, TransactionError, PushIdGenerator
+from remote_commands import CommandListener
+from status_server import StatusServer
+from loop_monitor import LoopMonitor
+from rrd import MetricStore
+from coin_table import CoinTable
+from dispense_telemetry import DispenseTelemetry, wait_for_ir
+from config import ConfigReloader, require_distinct_pins, require_positive
+import sdnotify
 
 # Check if running as a service
 def is_service():
     return os.getppid() == 1
 
+# Logging goes through a ring buffer and a background writer (VENDO_LOG_LEVEL=DEBUG shows every pulse)
+log = RingLogger("coinslot", level=os.environ.get("VENDO_LOG_LEVEL", "INFO"),
+                 syslog_prefix=is_service())
+
 # I2C LCD Configuration (adjust address if needed)
 LCD_ADDRESS = 0x27  # Common address, change to 0x3F if your display uses that
-lcd = CharLCD(i2c_expander='PCF8574', address=LCD_ADDRESS, port=1,
-              cols=16, rows=2, dotsize=8,
-              charmap='A02',
-              auto_linebreaks=True,
-              backlight_enabled=True)
+lcd = None  # Opened in setup()
 
 lcd_lock = threading.Lock()  # <-- Add this line
+lcd_restore_timer = None  # Pending return to the status screen after a message
 
-# Firebase configuration
-FIREBASE_HOST = "https://napkinvendo-default-rtdb.firebaseio.com/"
+# Firebase configuration (set FIREBASE_HOST to use a local emulator, see firebase_emulator.py)
+FIREBASE_HOST = os.environ.get("FIREBASE_HOST", "https://napkinvendo-default-rtdb.firebaseio.com/")
 FIREBASE_AUTH = "332a5927c0bd1bf572f995558e21b07d348e071d"
+MACHINE_ID = os.environ.get("VENDO_MACHINE_ID", socket.gethostname())  # Remote command queue: /commands/<MACHINE_ID>
+
+# Settings: these defaults can be overridden in coinslot.json and reloaded
+# live with SIGHUP or the remote "config" command (see config.py)
+DEFAULT_CONFIG = {
+    # Pin definitions
+    "COIN_PIN": 14,       # Coin acceptor input pin
+    "BUTTON1_PIN": 27,    # First button input pin
+    "RELAY1_PIN": 22,     # First relay control pin
+    "LED1_PIN": 23,       # LED to indicate when first button is active
+    "BUTTON2_PIN": 26,    # Second button input pin
+    "RELAY2_PIN": 25,     # Second relay control pin
+    "LED2_PIN": 24,       # LED to indicate when second button is active
+    "IR1_PIN": 18,        # First IR sensor input pin
+    "IR2_PIN": 19,        # Second IR sensor input pin
+    "MINIMUM_AMOUNT": 10.0,  # Minimum amount required (10 pesos)
+    "COIN_TIMEOUT": 0.5,     # Gap after the last pulse that ends a coin (seconds)
+    # Define peso values based on calibration
+    "coin_values": {
+        1: 1.00,    # H1: 1 peso coin (new)
+        5: 5.00,    # H3: 5 peso coin (new)
+        10: 10.00,  # H5: 10 peso coin (new)
+    },
+}
+CONFIG_FILE = os.environ.get("VENDO_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "coinslot.json"))
+
+INPUT_PINS = ("COIN_PIN", "BUTTON1_PIN", "BUTTON2_PIN", "IR1_PIN", "IR2_PIN")
+RELAY_PINS = ("RELAY1_PIN", "RELAY2_PIN")
+LED_PINS = ("LED1_PIN", "LED2_PIN")
+
+def validate_config(config):
+    require_distinct_pins(config, INPUT_PINS + RELAY_PINS + LED_PINS)
+    require_positive(config, "MINIMUM_AMOUNT", "COIN_TIMEOUT", "coin_values")
 
-# Clean up any previous GPIO setups
-GPIO.cleanup()
-
-# Configure GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-
-# Pin definitions
-COIN_PIN = 14       # Coin acceptor input pin
-BUTTON1_PIN = 27    # First button input pin
-RELAY1_PIN = 22     # First relay control pin
-LED1_PIN = 23       # LED to indicate when first button is active
-BUTTON2_PIN = 26    # Second button input pin
-RELAY2_PIN = 25     # Second relay control pin
-LED2_PIN = 24       # LED to indicate when second button is active
-IR1_PIN = 18        # First IR sensor input pin
-IR2_PIN = 19        # Second IR sensor input pin
-
-# Setup GPIO pins
-GPIO.setup(COIN_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(BUTTON1_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(RELAY1_PIN, GPIO.OUT)
-GPIO.setup(LED1_PIN, GPIO.OUT)
-GPIO.setup(BUTTON2_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(RELAY2_PIN, GPIO.OUT)
-GPIO.setup(LED2_PIN, GPIO.OUT)
-GPIO.setup(IR1_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(IR2_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-
-# Initialize outputs
-GPIO.output(RELAY1_PIN, GPIO.HIGH)  # Relay1 starts ON
-GPIO.output(LED1_PIN, GPIO.LOW)     # LED1 starts OFF
-GPIO.output(RELAY2_PIN, GPIO.HIGH)  # Relay2 starts ON
-GPIO.output(LED2_PIN, GPIO.LOW)     # LED2 starts OFF
+def setup_pin(name, pin):
+    """Configure one pin: inputs with pull-ups, relays and LEDs start OFF"""
+    if name in INPUT_PINS:
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    else:
+        GPIO.setup(pin, GPIO.OUT)
+        # Relays are active LOW
+        GPIO.output(pin, GPIO.HIGH if name in RELAY_PINS else GPIO.LOW)
+
+def apply_config(config, changed):
+    """Switch to new settings (called from the coin loop between iterations)"""
+    global coin_table
+    for name in INPUT_PINS + RELAY_PINS + LED_PINS:
+        if name in changed:
+            GPIO.cleanup(globals()[name])
+            setup_pin(name, config[name])
+    globals().update(config)
+    if "coin_values" in changed:
+        coin_table = CoinTable(coin_values)
+    if "MINIMUM_AMOUNT" in changed or changed & set(LED_PINS):
+        # LEDs, LCD and Firebase status are refreshed by coin_worker, off the sampling thread
+        coin_events.append(None)
+        coin_ready.set()
+
+config_reloader = None  # Loads CONFIG_FILE in setup()
+globals().update(DEFAULT_CONFIG)
+coin_table = CoinTable(coin_values)
 
 # Variables for coin detection
-total_value = 0.0
+credit_centavos = 0  # Customer credit; whole centavos so coins and prices add up exactly
 pulse_count = 0
 last_pulse_time = 0
-MINIMUM_AMOUNT = 10.0  # Minimum amount required (10 pesos)
 keyboard_enabled = False  # Flag to enable keyboard input after initialization
+keyboard_presses = collections.deque()  # Relays asked for on the keyboard, activated by the coin loop
+refunds = collections.deque()  # Remote refunds as (centavos, event set once credited), credited by the coin loop
 
-# Define peso values based on calibration
-coin_values = {
-    1: 1.00,    # H1: 1 peso coin (new)
-    5: 5.00,    # H3: 5 peso coin (new)
-    10: 10.00,  # H5: 10 peso coin (new)
-}
+# Coins credited by the loop, waiting for their side effects ((coin table, slot) pairs, see credit_coin;
+# None only refreshes the buttons)
+coin_events = collections.deque()
+coin_ready = threading.Event()
+
+# Firebase updates for coins, sales and vends, sent by sync_worker so a slow network never holds up the coin
+# loop or saving a coin; failed ones are retried
+# Writes are resent under the same push ID until one is confirmed, so a write that committed but
+# lost its reply is not applied twice
+unsynced_money = 0  # Centavos not yet confirmed in money_collected
+money_sending = None  # (push ID, centavos) being added to money_collected
+unsent_transactions = collections.deque()  # (push ID, sale) not yet recorded under /transactions
+push_ids = PushIdGenerator()
+status_changed = False
+sync_lock = threading.Lock()
+sync_ready = threading.Event()
+SYNC_RETRY_INTERVAL = 5  # Seconds between retries while Firebase is failing
 
 # Flag to control program execution
 running = True
 
-# IR sensor status
-ir1_triggered = False
-ir2_triggered = False
-
 # Relay activation tracking
 relay1_active = False
 relay2_active = False
@@ -92,197 +141,423 @@ relay2_active = False
 relay1_inventory = 0
 relay2_inventory = 0
 
+# Local inventory changes not yet applied in Firebase (sent as deltas, not absolute counts)
+pending_inventory = {1: 0, 2: 0}
+# Delta being sent per relay as (sequence, delta); (last sequence, 0) when none is. The sequence is
+# committed with the count under /inventory/applied/<MACHINE_ID>, so a delta whose reply was lost is
+# recognized, not applied again, when it is resent
+inventory_sending = {1: (0, 0), 2: (0, 0)}
+inventory_version = 0  # Bumped whenever a delta is committed
+inventory_lock = threading.Lock()
+# One sender per relay, so overlapping update_inventory() calls never send the same delta twice
+inventory_send_locks = {1: threading.Lock(), 2: threading.Lock()}
+inventory_shortfall = {1: 0, 2: 0}  # Sales Firebase had no stock left for (kept pending)
+
+# Coin loop health: runs every 10 ms, iterations over 100 ms are reported with the blocking call
+loop_monitor = LoopMonitor("Coin loop", period=0.01, budget=0.1, log=log)
+
+# Operational history kept on the device in fixed-size files (see rrd.py)
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")
+metrics = None  # Opened in setup()
+
+# Motor-to-IR timing per relay: adaptive dispense timeouts and jam warnings
+TELEMETRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coinslot.telemetry.json")
+telemetry = None  # Loaded in setup()
+
+# Recent sales kept in memory for the LAN status server
+recent_transactions = collections.deque(maxlen=50)
+started_at = time.time()
+
+# Crash-safe snapshot of credit, in-flight vends, inventory and unsent inventory deltas
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coinslot.state")
+state_store = None  # Opened in setup()
+
+def price_centavos():
+    """Price of one item in centavos"""
+    return round(MINIMUM_AMOUNT * 100)
+
+# State persistence functions
+def save_state():
+    """Save credit, in-flight vends, inventory and pending inventory deltas to the state file"""
+    price = price_centavos()
+    state_store.save(credit_centavos,
+                     (relay1_inventory, relay2_inventory),
+                     (price if relay1_active else 0, price if relay2_active else 0),
+                     (pending_inventory[1], pending_inventory[2]),
+                     (inventory_sending[1], inventory_sending[2]))
+    # Wake local dashboards waiting for a change
+    status_server.notify()
+
+def restore_state():
+    """Restore the state saved before the last exit or crash"""
+    global credit_centavos, relay1_inventory, relay2_inventory
+    snapshot = state_store.load()
+    if not snapshot:
+        log.info("No saved state found")
+        return
+    credit_centavos = snapshot["credit"]
+    with inventory_lock:
+        relay1_inventory, relay2_inventory = snapshot["inventory"]
+        # Sales and restocks made offline are still sent to Firebase as deltas
+        pending_inventory[1], pending_inventory[2] = snapshot["pending"]
+        inventory_sending[1], inventory_sending[2] = snapshot["sending"]
+    for relay_num, amount in enumerate(snapshot["inflight"], 1):
+        if amount:
+            # Relays were switched OFF during GPIO setup. Nothing is known to have dropped, so the
+            # vend is refunded and its unit put back, like a vend interrupted in vendo.py
+            log.warning("Relay %s was dispensing when the service stopped - relay is OFF, refunding ₱%.2f",
+                        relay_num, amount / 100)
+            credit_centavos += amount
+            adjust_inventory(relay_num, 1)
+    log.info("State restored: Credit ₱%.2f, Inventory: Relay1=%s, Relay2=%s, unsent changes: %+d, %+d",
+             credit_centavos / 100, relay1_inventory, relay2_inventory, pending_inventory[1], pending_inventory[2])
+    # Clear the in-flight vends now that the relays are known to be OFF
+    save_state()
+
+# LAN status server routes (see status_server.py)
+def get_status():
+    """Live state snapshot"""
+    return {
+        "machine_id": MACHINE_ID,
+        "total_value": credit_centavos / 100,
+        "minimum_amount": MINIMUM_AMOUNT,
+        "relay1_active": relay1_active,
+        "relay2_active": relay2_active,
+        "relay1_inventory": relay1_inventory,
+        "relay2_inventory": relay2_inventory,
+        "pending_inventory": {f"relay{n}": d for n, d in pending_inventory.items()},
+    }
+
+def get_transactions():
+    """Most recent sales, newest last"""
+    return list(recent_transactions)
+
+def get_health():
+    """Uptime and the state of the background threads"""
+    return {
+        "uptime": round(time.time() - started_at, 1),
+        "running": running,
+        "firebase_thread": firebase_thread is not None and firebase_thread.is_alive(),
+        "command_listener": command_listener is not None and command_listener.thread.is_alive(),
+        "log_dropped": log.dropped_total + log.dropped,
+        "state_seq": state_store.seq,
+        "loop": loop_monitor.stats(),
+        "config_reloads": config_reloader.reloads,
+        "dispensers": telemetry.stats(),
+    }
+
+def get_metrics(query):
+    """Metric history: /metrics lists names, /metrics?name=coins_5&start=-3600&res=60 returns samples"""
+    if "name" not in query:
+        return metrics.names()
+    start = float(query.get("start", ["-3600"])[0])
+    end = float(query["end"][0]) if "end" in query else None
+    resolution = float(query["res"][0]) if "res" in query else None
+    return metrics.fetch(query["name"][0], start, end, resolution)
+
+STATUS_PORT = int(os.environ.get("VENDO_STATUS_PORT", "8080"))
+status_server = None  # Created in setup()
+
 # LCD Functions
 def update_lcd():
     """Update LCD display with current status"""
+    # First line: Credit information
+    line1 = f"Credit: P{credit_centavos / 100:.2f}"
+    # Second line: Status or inventory info
+    if relay1_inventory <= 0 and relay2_inventory <= 0:
+        line2 = "Out of stock!"
+    elif credit_centavos < price_centavos():
+        line2 = f"Need P{(price_centavos() - credit_centavos) / 100:.2f} more"
+    else:
+        # Show available options
+        line2 = ""
+        if relay1_inventory > 0:
+            line2 += "B1:Ready "
+        if relay2_inventory > 0:
+            line2 += "B2:Ready"
     with lcd_lock:  # <-- Add this line
-        lcd.clear()
-        # First line: Credit information
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string(f"Credit: P{total_value:.2f}")
-        # Second line: Status or inventory info
-        lcd.cursor_pos = (1, 0)
-        # Show inventory status
-        if relay1_inventory <= 0 and relay2_inventory <= 0:
-            lcd.write_string("Out of stock!")
-        elif total_value < MINIMUM_AMOUNT:
-            lcd.write_string(f"Need P{MINIMUM_AMOUNT-total_value:.2f} more")
-        else:
-            # Show available options
-            available_text = ""
-            if relay1_inventory > 0:
-                available_text += "B1:Ready "
-            if relay2_inventory > 0:
-                available_text += "B2:Ready"
-            lcd.write_string(available_text)
+        # Whole frame goes out as one batch of block writes
+        lcd.write_frame(line1, line2)
 
 def display_message(line1, line2=""):
     """Display a temporary message on the LCD"""
+    global lcd_restore_timer
     with lcd_lock:  # <-- Add this line
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string(line1[:16])  # Limit to 16 chars
-        if line2:
-            lcd.cursor_pos = (1, 0)
-            lcd.write_string(line2[:16])  # Limit to 16 chars
+        lcd.write_frame(line1[:16], line2[:16])  # Limit to 16 chars
 
-    # Schedule to return to normal display after 2 seconds
-    threading.Timer(2.0, update_lcd).start()
+        # Schedule to return to normal display after 2 seconds, replacing any pending return
+        if lcd_restore_timer is not None:
+            lcd_restore_timer.cancel()
+        lcd_restore_timer = threading.Timer(2.0, update_lcd)
+        lcd_restore_timer.daemon = True
+        lcd_restore_timer.start()
 
 # Firebase communication functions
+def firebase_request(method, url, **kwargs):
+    """Send a Firebase REST request, counting requests and errors in the metrics store"""
+    metrics.record("firebase_requests")
+    try:
+        response = requests.request(method, url, **kwargs)
+    except Exception:
+        metrics.record("firebase_errors")
+        raise
+    # 412 is a normal compare-and-swap conflict, not an error
+    if response.status_code >= 400 and response.status_code != 412:
+        metrics.record("firebase_errors")
+    return response
+
 def initialize_firebase():
     """Initialize and fetch data from Firebase"""
-    global relay1_inventory, relay2_inventory
-    
     try:
         # Display initialization message
         display_message("Connecting to", "Firebase...")
         
         # Fetch initial inventory values
-        response = requests.get(f"{FIREBASE_HOST}/inventory.json")
+        version = inventory_version
+        # Bounded so a black-holed network cannot hold start-up past systemd's TimeoutStartSec
+        response = firebase_request("GET", f"{FIREBASE_HOST}/inventory.json", timeout=10)
         if response.status_code == 200:
             data = response.json()
-            if data and 'relay1' in data:
-                relay1_inventory = data['relay1']
-            if data and 'relay2' in data:
-                relay2_inventory = data['relay2']
-            print(f"Firebase connected. Inventory: Relay1={relay1_inventory}, Relay2={relay2_inventory}")
+            if data:
+                apply_firebase_inventory(data, version)
+            log.info("Firebase connected. Inventory: Relay1=%s, Relay2=%s", relay1_inventory, relay2_inventory)
+            save_state()
             display_message("Firebase", "Connected!")
         else:
-            print(f"Failed to fetch inventory data. Status code: {response.status_code}")
+            log.warning("Failed to fetch inventory data. Status code: %s", response.status_code)
             display_message("Firebase Error", "Check connection")
             
         # Send initial system status
         update_system_status()
         return True
     except Exception as e:
-        print(f"Firebase initialization error: {e}")
+        log.error("Firebase initialization error: %s", e)
         display_message("Firebase Error", str(e)[:16])
         return False
 
+def set_inventory(relay_num, count):
+    """Set the local inventory count of one relay"""
+    global relay1_inventory, relay2_inventory
+    if relay_num == 1:
+        relay1_inventory = count
+    else:
+        relay2_inventory = count
+
+def get_inventory(relay_num):
+    return relay1_inventory if relay_num == 1 else relay2_inventory
+
+def adjust_inventory(relay_num, delta):
+    """Change local inventory now and queue the same delta for Firebase"""
+    with inventory_lock:
+        set_inventory(relay_num, get_inventory(relay_num) + delta)
+        pending_inventory[relay_num] += delta
+
+def apply_firebase_inventory(data, version):
+    """Set local inventory from Firebase counts, keeping unsynced local changes
+
+    'version' is inventory_version from before the counts were read; if a
+    delta was committed since then the counts are stale and are ignored.
+    """
+    changed = False
+    with inventory_lock:
+        for relay_num in (1, 2):
+            seq, delta = inventory_sending[relay_num]
+            record = ((data.get("applied") or {}).get(MACHINE_ID) or {}).get(f"relay{relay_num}")
+            if record and record["seq"] > seq and not delta:
+                # The state file was lost: carry on after the last delta Firebase has from us
+                inventory_sending[relay_num] = (record["seq"], 0)
+        if version != inventory_version:
+            return False
+        for relay_num in (1, 2):
+            key = f"relay{relay_num}"
+            if key not in data or data[key] is None:
+                continue
+            count = max(data[key] + pending_inventory[relay_num], 0)
+            if count != get_inventory(relay_num):
+                set_inventory(relay_num, count)
+                changed = True
+                log.info("Relay %s inventory updated from Firebase: %s", relay_num, count)
+    return changed
+
 def update_inventory():
-    """Update inventory in Firebase"""
-    try:
-        inventory_data = {
-            "relay1": relay1_inventory,
-            "relay2": relay2_inventory
-        }
-        response = requests.patch(f"{FIREBASE_HOST}/inventory.json", data=json.dumps(inventory_data))
-        if response.status_code == 200:
-            print("Inventory updated in Firebase")
-        else:
-            print(f"Failed to update inventory. Status code: {response.status_code}")
-            display_message("Update Error", "Inventory sync")
-    except Exception as e:
-        print(f"Firebase inventory update error: {e}")
-        display_message("Firebase Error", str(e)[:16])
+    """Apply pending inventory deltas in Firebase with compare-and-swap transactions"""
+    global inventory_version
+    for relay_num in (1, 2):
+        key = f"relay{relay_num}"
+        # Held from reading the delta until it is subtracted: the coin loop, the
+        # Firebase thread and remote commands all call this
+        with inventory_send_locks[relay_num]:
+            with inventory_lock:
+                seq, delta = inventory_sending[relay_num]
+                started = not delta
+                if started:
+                    # Nothing unconfirmed: send everything pending under a new sequence
+                    delta = pending_inventory[relay_num]
+                    seq += 1
+                    if delta:
+                        inventory_sending[relay_num] = (seq, delta)
+            if not delta:
+                continue
+            if started:
+                # A restart resends this delta under the same sequence
+                save_state()
+            def apply_delta(current):
+                node = dict(current or {})
+                applied = dict(node.get("applied") or {})
+                mine = dict(applied.get(MACHINE_ID) or {})
+                if (mine.get(key) or {}).get("seq", 0) >= seq:
+                    # Committed before but the reply was lost: leave it as it is
+                    return current
+                count = node.get(key) or 0
+                # Never let the shared count go negative, even if another machine sold the last unit
+                node[key] = max(count + delta, 0)
+                mine[key] = {"seq": seq, "delta": node[key] - count}
+                applied[MACHINE_ID] = mine
+                node["applied"] = applied
+                return node
+            try:
+                node = transaction(f"{FIREBASE_HOST}/inventory.json", apply_delta, request=firebase_request)
+                new_count = node[key]
+                # Less than the delta if the count was clamped at 0; the rest stays pending
+                applied = node["applied"][MACHINE_ID][key]["delta"]
+                with inventory_lock:
+                    pending_inventory[relay_num] -= applied
+                    inventory_sending[relay_num] = (seq, 0)
+                    inventory_version += 1
+                    set_inventory(relay_num, max(new_count + pending_inventory[relay_num], 0))
+                # The sent delta must not be sent again after a restart
+                save_state()
+                if applied != delta:
+                    # Retried every Firebase check until restocked: only report a new shortfall
+                    if delta - applied != inventory_shortfall[relay_num]:
+                        log.warning("Relay %s oversold in Firebase: %+d of %+d applied, rest kept pending",
+                                    relay_num, applied, delta)
+                    inventory_shortfall[relay_num] = delta - applied
+                else:
+                    inventory_shortfall[relay_num] = 0
+                    log.info("Inventory updated in Firebase: Relay %s %+d -> %s", relay_num, delta, new_count)
+            except TransactionError as e:
+                log.warning("Failed to update inventory: %s", e)
+                display_message("Update Error", "Inventory sync")
+            except Exception as e:
+                log.error("Firebase inventory update error: %s", e)
+                display_message("Firebase Error", str(e)[:16])
 
 def update_transactions(relay_num, amount):
-    """Record transaction in Firebase"""
+    """Record a sale locally and queue it for Firebase (sent by sync_worker)"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    transaction_data = {
+        "relay": relay_num,
+        "amount": amount,
+        "timestamp": timestamp
+    }
+    recent_transactions.append(transaction_data)
+    status_server.notify()
+    unsent_transactions.append((push_ids.next_id(), transaction_data))
+    sync_ready.set()
+
+def send_transaction(push_id, transaction_data):
+    """Write one transaction to Firebase under its push ID; False if it has to be retried"""
     try:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        transaction_data = {
-            "relay": relay_num,
-            "amount": amount,
-            "timestamp": timestamp
-        }
-        # Use push() equivalent for HTTP requests to add to list
-        response = requests.post(f"{FIREBASE_HOST}/transactions.json", data=json.dumps(transaction_data))
+        # PUT to an ID made here rather than POST, so a resend overwrites instead of adding a copy
+        response = firebase_request("PUT", f"{FIREBASE_HOST}/transactions/{push_id}.json",
+                                    data=json.dumps(transaction_data), timeout=10)
         if response.status_code == 200:
-            print(f"Transaction recorded: Relay {relay_num}, ₱{amount:.2f}")
-        else:
-            print(f"Failed to record transaction. Status code: {response.status_code}")
+            log.info("Transaction recorded: Relay %s, ₱%.2f", transaction_data["relay"], transaction_data["amount"])
+            return True
+        log.warning("Failed to record transaction. Status code: %s", response.status_code)
     except Exception as e:
-        print(f"Firebase transaction recording error: {e}")
+        log.error("Firebase transaction recording error: %s", e)
+    return False
+
+def update_money_collected(amount, push_id):
+    """Add to money collected in Firebase; False if it has to be retried
 
-def update_money_collected(amount):
-    """Update money collection in Firebase"""
+    money_collected is {"total": pesos, "applied": {machine ID: push ID}}:
+    the ID of the last amount each machine added is committed with the
+    total, so an amount resent after a lost reply is not added again.
+    """
+    def add_amount(current):
+        # A plain number is a total from before the applied IDs were kept
+        node = dict(current) if isinstance(current, dict) else {"total": current or 0}
+        applied = dict(node.get("applied") or {})
+        if applied.get(MACHINE_ID) == push_id:
+            return current
+        node["total"] = round(float(node.get("total") or 0) + amount, 2)
+        applied[MACHINE_ID] = push_id
+        node["applied"] = applied
+        return node
     try:
-        # Get current total first
-        response = requests.get(f"{FIREBASE_HOST}/money_collected.json")
-        current_total = 0
-        if response.status_code == 200 and response.json() is not None:
-            current_total = float(response.json())
-        
-        # Update with new amount
-        new_total = current_total + amount
-        response = requests.put(f"{FIREBASE_HOST}/money_collected.json", data=json.dumps(new_total))
-        if response.status_code == 200:
-            print(f"Money collected updated: ₱{new_total:.2f}")
-        else:
-            print(f"Failed to update money collected. Status code: {response.status_code}")
+        # Compare-and-swap, so a failed read never overwrites the total
+        node = transaction(f"{FIREBASE_HOST}/money_collected.json", add_amount, request=firebase_request)
+        log.info("Money collected updated: ₱%.2f", node["total"])
+        return True
+    except TransactionError as e:
+        log.warning("Failed to update money collected: %s", e)
     except Exception as e:
-        print(f"Firebase money collection update error: {e}")
+        log.error("Firebase money collection update error: %s", e)
+    return False
 
 def update_system_status():
     """Update system status in Firebase"""
     try:
         status_data = {
-            "total_value": total_value,
+            "total_value": credit_centavos / 100,
             "relay1_active": relay1_active,
             "relay2_active": relay2_active,
             "relay1_inventory": relay1_inventory,
             "relay2_inventory": relay2_inventory,
+            "relay1_health": telemetry.health(1),
+            "relay2_health": telemetry.health(2),
             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
-        response = requests.patch(f"{FIREBASE_HOST}/system_status.json", data=json.dumps(status_data))
+        response = firebase_request("PATCH", f"{FIREBASE_HOST}/system_status.json",
+                                    data=json.dumps(status_data), timeout=10)
         if response.status_code == 200:
-            print("System status updated in Firebase")
+            log.info("System status updated in Firebase")
         else:
-            print(f"Failed to update system status. Status code: {response.status_code}")
+            log.warning("Failed to update system status. Status code: %s", response.status_code)
     except Exception as e:
-        print(f"Firebase status update error: {e}")
+        log.error("Firebase status update error: %s", e)
 
 def check_firebase_updates():
     """Thread function to periodically check for updates from Firebase"""
-    global relay1_inventory, relay2_inventory, running
-    
     while running:
         try:
-            response = requests.get(f"{FIREBASE_HOST}/inventory.json")
+            # Retry inventory deltas that could not be sent earlier
+            if any(pending_inventory.values()):
+                update_inventory()
+            
+            version = inventory_version
+            response = firebase_request("GET", f"{FIREBASE_HOST}/inventory.json", timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 if data:
                     # Update local inventory if changed in Firebase
-                    inventory_changed = False
-                    if 'relay1' in data and relay1_inventory != data['relay1']:
-                        relay1_inventory = data['relay1']
-                        inventory_changed = True
-                        print(f"Relay 1 inventory updated from Firebase: {relay1_inventory}")
-                    if 'relay2' in data and relay2_inventory != data['relay2']:
-                        relay2_inventory = data['relay2']
-                        inventory_changed = True
-                        print(f"Relay 2 inventory updated from Firebase: {relay2_inventory}")
+                    inventory_changed = apply_firebase_inventory(data, version)
                     
                     # Update LCD if inventory changed
                     if inventory_changed:
+                        save_state()
                         update_lcd()
                         update_button_status()
-            
-            # Check for remote commands
-            response = requests.get(f"{FIREBASE_HOST}/commands.json")
-            if response.status_code == 200:
-                commands = response.json()
-                if commands:
-                    if 'shutdown' in commands and commands['shutdown']:
-                        print("Remote shutdown command received")
-                        display_message("Remote Shutdown", "Command Received")
-                        running = False
-                        
-                    # Reset commands after processing
-                    requests.put(f"{FIREBASE_HOST}/commands.json", data=json.dumps({"shutdown": False}))
                         
         except Exception as e:
-            print(f"Error checking Firebase updates: {e}")
+            log.error("Error checking Firebase updates: %s", e)
         
         # Check every 5 seconds
         time.sleep(5)
 
-def update_button_status():
-    """Update the button status LEDs based on available credit and inventory"""
+def update_button_status(sync=True):
+    """Update the button status LEDs based on available credit and inventory
+
+    sync=False leaves the Firebase status update to the caller.
+    """
     # Check both credit and inventory conditions
-    relay1_available = total_value >= MINIMUM_AMOUNT and relay1_inventory > 0
-    relay2_available = total_value >= MINIMUM_AMOUNT and relay2_inventory > 0
+    credit = credit_centavos / 100
+    price = price_centavos()
+    relay1_available = credit_centavos >= price and relay1_inventory > 0
+    relay2_available = credit_centavos >= price and relay2_inventory > 0
     
     # Update LED status based on availability
     GPIO.output(LED1_PIN, GPIO.HIGH if relay1_available else GPIO.LOW)
@@ -290,76 +565,165 @@ def update_button_status():
     
     # Print status update
     if relay1_available and relay2_available:
-        print(f"Both buttons are ACTIVE (₱{total_value:.2f} available)")
+        log.info("Both buttons are ACTIVE (₱%.2f available)", credit)
     elif relay1_available:
-        print(f"Only Button 1 ACTIVE (₱{total_value:.2f} available, Relay 2 out of stock)")
+        log.info("Only Button 1 ACTIVE (₱%.2f available, Relay 2 out of stock)", credit)
     elif relay2_available:
-        print(f"Only Button 2 ACTIVE (₱{total_value:.2f} available, Relay 1 out of stock)")
+        log.info("Only Button 2 ACTIVE (₱%.2f available, Relay 1 out of stock)", credit)
     else:
-        if total_value < MINIMUM_AMOUNT:
-            print(f"Buttons are INACTIVE (₱{total_value:.2f} available, need ₱{MINIMUM_AMOUNT-total_value:.2f} more)")
+        if credit_centavos < price:
+            log.info("Buttons are INACTIVE (₱%.2f available, need ₱%.2f more)", credit, (price - credit_centavos) / 100)
         else:
-            print("Buttons are INACTIVE (Out of stock)")
+            log.info("Buttons are INACTIVE (Out of stock)")
     
     # Update LCD display
     update_lcd()
     
     # Update system status in Firebase
-    update_system_status()
-
-def check_ir_sensors():
-    """Check the status of IR sensors and handle relay deactivation if needed"""
-    global ir1_triggered, ir2_triggered, relay1_active, relay2_active
-    # Check IR sensor 1
-    ir1_state = GPIO.input(IR1_PIN)
-    if ir1_state == GPIO.LOW:  # Object detected (LOW when object is present)
-        if not ir1_triggered and relay1_active:
-            print("IR Sensor 1: Object detected - stopping relay 1")
-            time.sleep(2)  # <-- Add 1 second delay before stopping relay
-            GPIO.output(RELAY1_PIN, GPIO.HIGH)  # Turn OFF relay immediately
-            relay1_active = False
-            ir1_triggered = True
-            display_message("Item Dispensed", "Thank You!")
-            update_system_status()  # Update Firebase about relay state change
-    else:
-        if ir1_triggered:
-            print("IR Sensor 1: Path clear")
-            ir1_triggered = False
-    # Check IR sensor 2
-    ir2_state = GPIO.input(IR2_PIN)
-    if ir2_state == GPIO.LOW:  # Object detected (LOW when object is present)
-        if not ir2_triggered and relay2_active:
-            print("IR Sensor 2: Object detected - stopping relay 2")
-            time.sleep(2)  # <-- Add 1 second delay before stopping relay
-            GPIO.output(RELAY2_PIN, GPIO.HIGH)  # Turn OFF relay immediately
-            relay2_active = False
-            ir2_triggered = True
-            display_message("Item Dispensed", "Thank You!")
-            update_system_status()  # Update Firebase about relay state change
-    else:
-        if ir2_triggered:
-            print("IR Sensor 2: Path clear")
-            ir2_triggered = False
+    if sync:
+        update_system_status()
+
+def record_dispense(relay_num, ir_time, pulse_width):
+    """Record a vend's motor-on to IR time and IR pulse width, or a timeout (ir_time None)"""
+    if ir_time is None:
+        metrics.record(f"timeouts_relay{relay_num}")
+        telemetry.record_timeout(relay_num)
+        return
+    metrics.record(f"vends_relay{relay_num}")
+    metrics.record(f"ir_time_relay{relay_num}", ir_time)
+    if pulse_width is not None:
+        metrics.record(f"ir_width_relay{relay_num}", pulse_width)
+    telemetry.record_vend(relay_num, ir_time, pulse_width)
+
+def record_loop_metrics():
+    """Thread function to store coin loop timing every 10 seconds"""
+    while running:
+        time.sleep(10)
+        window = loop_monitor.take_window()
+        if window["iterations"]:
+            metrics.record("loop_p50_ms", window["p50_ms"])
+            metrics.record("loop_p99_ms", window["p99_ms"])
+            metrics.record("loop_max_ms", window["max_ms"])
+
+def credit_coin(pulses):
+    """Credit a finished coin from the coin loop: a table lookup, an add and a queue append
+
+    Saving state, the LCD, logging and Firebase are left to coin_worker so
+    the sampling thread never blocks on I/O. The table goes with the slot,
+    so a coin_values reload cannot change a coin already credited.
+    """
+    global credit_centavos
+    table = coin_table
+    slot = table.index(pulses)
+    credit_centavos += table.centavos[slot]
+    coin_events.append((table, slot))
+    if not coin_ready.is_set():
+        coin_ready.set()
+
+def coin_worker():
+    """Thread function for the side effects of credited coins, in order
+
+    Every coin queued so far is saved before anything else; the Firebase
+    updates go to sync_worker.
+    """
+    while running or coin_events:
+        coin_ready.wait(0.5)
+        coin_ready.clear()
+        batch = []
+        while coin_events:
+            batch.append(coin_events.popleft())
+        if not batch:
+            continue
+        save_state()
+        credited = 0
+        for event in batch:
+            if event is None:
+                continue
+            table, slot = event
+            try:
+                metrics.record(table.metric_names[slot])
+                centavos = table.centavos[slot]
+                if centavos:
+                    credited += centavos
+                    log.info("Coin detected: ₱%.2f, Total: ₱%.2f", centavos / 100, credit_centavos / 100)
+                    display_message(table.coin_lines[slot], f"Total: P{credit_centavos / 100:.2f}")
+                else:
+                    log.warning("Unknown coin: %s", table.unknown_lines[slot])
+                    display_message("Unknown Coin", table.unknown_lines[slot])
+            except Exception as e:
+                log.error("Error handling coin: %s", e)
+        try:
+            update_button_status(sync=False)
+        except Exception as e:
+            log.error("Error updating buttons: %s", e)
+        request_sync(credited)
+
+def request_sync(centavos=0):
+    """Queue money collected (centavos), pending inventory and a system status update for sync_worker"""
+    global unsynced_money, status_changed
+    with sync_lock:
+        unsynced_money += centavos
+        status_changed = True
+    sync_ready.set()
+
+def sync_worker():
+    """Thread function sending coins, sales and inventory to Firebase, several coins per request when it is slow"""
+    global unsynced_money, money_sending, status_changed
+    while running or unsynced_money or status_changed or unsent_transactions:
+        sync_ready.wait(0.5)
+        sync_ready.clear()
+        failed = False
+        while unsent_transactions and not failed:
+            if send_transaction(*unsent_transactions[0]):
+                unsent_transactions.popleft()
+            else:
+                failed = True
+        with sync_lock:
+            if not money_sending and unsynced_money:
+                # Coins since the last confirmed update, resent as they are until confirmed
+                money_sending = (push_ids.next_id(), unsynced_money)
+            status, status_changed = status_changed, False
+        if money_sending:
+            push_id, centavos = money_sending
+            if update_money_collected(centavos / 100, push_id):
+                money_sending = None
+                with sync_lock:
+                    unsynced_money -= centavos
+            else:
+                failed = True
+        if any(pending_inventory.values()):
+            # Failures stay pending and are retried here or by check_firebase_updates
+            update_inventory()
+        if status:
+            update_system_status()
+        if failed:
+            time.sleep(SYNC_RETRY_INTERVAL)
 
 def activate_relay1():
     """Function to activate the first relay"""
-    global total_value, relay1_active, relay1_inventory
+    global credit_centavos, relay1_active
+    
+    # A second press while the motor runs must not charge again
+    if relay1_active:
+        log.info("Relay 1 is still dispensing")
+        return False
     
     # Check IR sensor before activating relay
     if GPIO.input(IR1_PIN) == GPIO.LOW:
-        print("Cannot activate relay 1: Object detected by IR sensor 1")
+        log.warning("Cannot activate relay 1: Object detected by IR sensor 1")
         display_message("Error", "Dispenser blocked")
         return False
     
     # Check both credit and inventory
-    if total_value >= MINIMUM_AMOUNT and relay1_inventory > 0:
-        print("Activating relay 1...")
+    price = price_centavos()
+    if credit_centavos >= price and relay1_inventory > 0:
+        log.info("Activating relay 1...")
         display_message("Dispensing...", "Please wait")
         GPIO.output(RELAY1_PIN, GPIO.LOW)  # Turn ON relay1
         relay1_active = True
         
-        # Update inventory in local tracking
-        relay1_inventory -= 1
+        # Reserve the unit locally; the sale is sent to Firebase as a -1 delta
+        adjust_inventory(1, -1)
         
         # Start a monitoring thread for the relay activation
         relay_monitor = threading.Thread(target=monitor_relay_activation, args=(1, RELAY1_PIN, IR1_PIN))
@@ -367,47 +731,53 @@ def activate_relay1():
         relay_monitor.start()
         
         # Deduct the amount used
-        total_value -= MINIMUM_AMOUNT
+        credit_centavos -= price
+        save_state()
         
         # Record this transaction without adding to money_collected
-        update_transactions(1, MINIMUM_AMOUNT)
+        update_transactions(1, price / 100)
         # NOT calling update_money_collected here as requested
         
-        # Update Firebase with new inventory and system status
-        update_inventory()
-        update_system_status()
+        # Inventory and system status go to Firebase from sync_worker, off the coin loop
+        request_sync()
         
-        print(f"Relay 1 activated. Remaining credit: ₱{total_value:.2f}, Inventory: {relay1_inventory}")
-        update_button_status()
+        log.info("Relay 1 activated. Remaining credit: ₱%.2f, Inventory: %s", credit_centavos / 100, relay1_inventory)
+        update_button_status(sync=False)
         return True
     else:
-        if total_value < MINIMUM_AMOUNT:
-            print(f"Not enough credit. Need ₱{MINIMUM_AMOUNT-total_value:.2f} more.")
-            display_message("Low Credit", f"Need P{MINIMUM_AMOUNT-total_value:.2f} more")
+        if credit_centavos < price:
+            log.info("Not enough credit. Need ₱%.2f more.", (price - credit_centavos) / 100)
+            display_message("Low Credit", f"Need P{(price - credit_centavos) / 100:.2f} more")
         else:
-            print("Relay 1 is out of stock.")
+            log.info("Relay 1 is out of stock.")
             display_message("Out of Stock", "Item 1")
         return False
 
 def activate_relay2():
     """Function to activate the second relay"""
-    global total_value, relay2_active, relay2_inventory
+    global credit_centavos, relay2_active
+    
+    # A second press while the motor runs must not charge again
+    if relay2_active:
+        log.info("Relay 2 is still dispensing")
+        return False
     
     # Check IR sensor before activating relay
     if GPIO.input(IR2_PIN) == GPIO.LOW:
-        print("Cannot activate relay 2: Object detected by IR sensor 2")
+        log.warning("Cannot activate relay 2: Object detected by IR sensor 2")
         display_message("Error", "Dispenser blocked")
         return False
     
     # Check both credit and inventory
-    if total_value >= MINIMUM_AMOUNT and relay2_inventory > 0:
-        print("Activating relay 2...")
+    price = price_centavos()
+    if credit_centavos >= price and relay2_inventory > 0:
+        log.info("Activating relay 2...")
         display_message("Dispensing...", "Please wait")
         GPIO.output(RELAY2_PIN, GPIO.LOW)  # Turn ON relay2
         relay2_active = True
         
-        # Update inventory in local tracking
-        relay2_inventory -= 1
+        # Reserve the unit locally; the sale is sent to Firebase as a -1 delta
+        adjust_inventory(2, -1)
         
         # Start a monitoring thread for the relay activation
         relay_monitor = threading.Thread(target=monitor_relay_activation, args=(2, RELAY2_PIN, IR2_PIN))
@@ -415,72 +785,126 @@ def activate_relay2():
         relay_monitor.start()
         
         # Deduct the amount used
-        total_value -= MINIMUM_AMOUNT
+        credit_centavos -= price
+        save_state()
         
         # Record this transaction without adding to money_collected
-        update_transactions(2, MINIMUM_AMOUNT)
+        update_transactions(2, price / 100)
         # NOT calling update_money_collected here as requested
         
-        # Update Firebase with new inventory and system status
-        update_inventory()
-        update_system_status()
+        # Inventory and system status go to Firebase from sync_worker, off the coin loop
+        request_sync()
         
-        print(f"Relay 2 activated. Remaining credit: ₱{total_value:.2f}, Inventory: {relay2_inventory}")
-        update_button_status()
+        log.info("Relay 2 activated. Remaining credit: ₱%.2f, Inventory: %s", credit_centavos / 100, relay2_inventory)
+        update_button_status(sync=False)
         return True
     else:
-        if total_value < MINIMUM_AMOUNT:
-            print(f"Not enough credit. Need ₱{MINIMUM_AMOUNT-total_value:.2f} more.")
-            display_message("Low Credit", f"Need P{MINIMUM_AMOUNT-total_value:.2f} more")
+        if credit_centavos < price:
+            log.info("Not enough credit. Need ₱%.2f more.", (price - credit_centavos) / 100)
+            display_message("Low Credit", f"Need P{(price - credit_centavos) / 100:.2f} more")
         else:
-            print("Relay 2 is out of stock.")
+            log.info("Relay 2 is out of stock.")
             display_message("Out of Stock", "Item 2")
         return False
 
 def monitor_relay_activation(relay_num, relay_pin, ir_pin):
-    """Monitor the IR sensor during relay activation and stop if needed"""
+    """Run the relay until the IR sensor sees the item or the relay's timeout passes"""
     global relay1_active, relay2_active
-    activation_time = time.time()
-    max_activation_time = 10  # Maximum time the relay can stay active (10 seconds)
-    # Use relay_active flags instead of trying to read GPIO output
-    active = True
-    while active:
-        # Update the active state based on relay number
-        if relay_num == 1:
-            active = relay1_active
-        else:
-            active = relay2_active
-        # Check if IR sensor detects an object
-        if GPIO.input(ir_pin) == GPIO.LOW:
-            print(f"IR Sensor {relay_num}: Object detected - stopping relay {relay_num}")
-            time.sleep(2)  # <-- Add 1 second delay before stopping relay
-            GPIO.output(relay_pin, GPIO.HIGH)  # Turn OFF relay immediately
-            if relay_num == 1:
-                relay1_active = False
-            else:
-                relay2_active = False
-            update_system_status()  # Update Firebase about relay state change
-            break
-        # Check if maximum activation time is reached
-        if time.time() - activation_time >= max_activation_time:
-            print(f"Maximum activation time reached for relay {relay_num}")
-            GPIO.output(relay_pin, GPIO.HIGH)  # Turn OFF relay
-            if relay_num == 1:
-                relay1_active = False
-            else:
-                relay2_active = False
-            display_message("Timeout", "Please try again")
-            update_system_status()  # Update Firebase about relay state change
-            break
-        time.sleep(0.05)  # Short delay to reduce CPU usage
-    print(f"Relay {relay_num} monitoring ended")
-    update_lcd()  # Update LCD after relay operation completes
+    # Timeout adapts to how long this relay usually takes (10 s until it has history)
+    max_activation_time = telemetry.timeout(relay_num)
+    # Keep the motor on for 2 seconds after the IR sensor fires, timing the IR pulse meanwhile
+    ir_time, pulse_width = wait_for_ir(lambda: GPIO.input(ir_pin) == GPIO.LOW,
+                                       max_activation_time, run_on=2.0)
+    GPIO.output(relay_pin, GPIO.HIGH)  # Turn OFF relay
+    if relay_num == 1:
+        relay1_active = False
+    else:
+        relay2_active = False
+    if ir_time is None:
+        log.warning("Maximum activation time (%.1f s) reached for relay %s", max_activation_time, relay_num)
+        display_message("Timeout", "Please try again")
+    else:
+        log.info("IR Sensor %s: Object detected after %.2f s - relay %s stopped", relay_num, ir_time, relay_num)
+        display_message("Item Dispensed", "Thank You!")
+    record_dispense(relay_num, ir_time, pulse_width)
+    save_state()
+    update_system_status()  # Update Firebase about relay state change
+    log.info("Relay %s monitoring ended", relay_num)
+
+# Remote command handlers (see remote_commands.py)
+def command_shutdown(args):
+    """Stop the machine"""
+    global running
+    display_message("Remote Shutdown", "Command Received")
+    running = False
+    return "shutting down"
+
+def command_restock(args):
+    """Add units to a relay: {"relay": 1, "count": 20}"""
+    relay_num = int(args["relay"])
+    count = int(args["count"])
+    if relay_num not in (1, 2) or count <= 0:
+        raise ValueError("relay must be 1 or 2 and count positive")
+    adjust_inventory(relay_num, count)
+    save_state()
+    update_inventory()
+    update_button_status()
+    return get_inventory(relay_num)
+
+def command_price(args):
+    """Change the price of an item: {"price": 12}"""
+    # Saved to the settings file and applied once no coin or vend is in progress
+    return config_reloader.update({"MINIMUM_AMOUNT": float(args["price"])})["MINIMUM_AMOUNT"]
+
+def command_config(args):
+    """Change settings and reload them: {"MINIMUM_AMOUNT": 12, "coin_values": {"1": 1, "5": 5}}"""
+    config = config_reloader.update(args)
+    return {key: config[key] for key in args}
+
+def command_refund(args):
+    """Give credit back to the customer: {"amount": 10}"""
+    amount = round(float(args["amount"]) * 100)
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    # Credited by the coin loop like keyboard presses; the ack waits until the credit is saved
+    credited = threading.Event()
+    refunds.append((amount, credited))
+    while not credited.wait(0.5):
+        if not running:
+            raise RuntimeError("stopped before the refund was credited")
+    return credit_centavos / 100
+
+def credit_refunds():
+    """Credit queued remote refunds (coin loop only)"""
+    global credit_centavos
+    while refunds:
+        amount, credited = refunds.popleft()
+        credit_centavos += amount
+        save_state()
+        log.info("Refunded ₱%.2f. Credit: ₱%.2f", amount / 100, credit_centavos / 100)
+        credited.set()
+        update_button_status(sync=False)
+        request_sync()
+
+def command_display(args):
+    """Show a message on the LCD: {"line1": "...", "line2": "..."}"""
+    display_message(str(args.get("line1", "")), str(args.get("line2", "")))
+    return "shown"
+
+REMOTE_COMMANDS = {
+    "shutdown": command_shutdown,
+    "restock": command_restock,
+    "price": command_price,
+    "refund": command_refund,
+    "display": command_display,
+    "config": command_config,
+}
 
 def getch():
     """Get a single character from the terminal"""
     # Skip if running as a service
     if is_service():
-        print("Cannot read keyboard input in service mode")
+        log.warning("Cannot read keyboard input in service mode")
         time.sleep(1)  # Add a small delay to prevent CPU usage
         return 'x'  # Return a dummy character
         
@@ -499,145 +923,237 @@ def keyboard_monitor():
     
     # Skip keyboard monitoring if running as a service
     if is_service():
-        print("Running as a service - keyboard monitoring disabled")
+        log.info("Running as a service - keyboard monitoring disabled")
         return
     
     # Wait for system to fully initialize before accepting keyboard input
     time.sleep(3)
     keyboard_enabled = True
-    print("Keyboard monitor active. Press '1' to activate button 1, '2' to activate button 2, 'q' to quit.")
+    log.info("Keyboard monitor active. Press '1' to activate button 1, '2' to activate button 2, 'q' to quit.")
     
     while running:
         char = getch()
         if char == '1' and keyboard_enabled:
-            print("Key '1' pressed - attempting to activate button 1")
-            activate_relay1()
+            log.info("Key '1' pressed - attempting to activate button 1")
+            keyboard_presses.append(1)
         elif char == '2' and keyboard_enabled:
-            print("Key '2' pressed - attempting to activate button 2")
-            activate_relay2()
+            log.info("Key '2' pressed - attempting to activate button 2")
+            keyboard_presses.append(2)
         elif char == 'q':
-            print("Quit command received")
+            log.info("Quit command received")
             display_message("Shutting down...", "Goodbye!")
             running = False
             break
 
-try:
-    print("System initializing...")
-    display_message("Napkin Vendo", "Initializing...")
-    
-    # Log if running as a service
-    if is_service():
-        print("Running in service mode - keyboard control disabled")
+firebase_thread = None
+command_listener = None
+coin_thread = None
+sync_thread = None
+
+def setup():
+    """Open the log, LCD, settings, state and metric files and set up the GPIO pins"""
+    global lcd, config_reloader, coin_table, metrics, telemetry, state_store, status_server
+    log.start()
+    loop_monitor.log = log
     
-    print("Connecting to Firebase...")
+    # I2C LCD
+    lcd = BatchedLCD(smbus.SMBus(1), address=LCD_ADDRESS,
+                     cols=16, rows=2,
+                     backlight_enabled=True)
     
-    # Initialize Firebase connection
-    firebase_ready = initialize_firebase()
-    if not firebase_ready:
-        print("Warning: Firebase connection failed. System will run in offline mode.")
-        display_message("Offline Mode", "No connection")
+    # Clean up any previous GPIO setups
+    GPIO.cleanup()
     
-    # Start Firebase monitoring thread
-    firebase_thread = threading.Thread(target=check_firebase_updates)
-    firebase_thread.daemon = True
-    firebase_thread.start()
+    # Configure GPIO
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setwarnings(False)
     
-    print("Coin detector active. Insert coins...")
-    display_message("Ready", "Insert coins")
-    print(f"Minimum amount required: ₱{MINIMUM_AMOUNT:.2f}")
-    print("IR sensors active. Will stop relays when objects are detected.")
+    config_reloader = ConfigReloader(CONFIG_FILE, DEFAULT_CONFIG, apply_config, validate_config, log)
+    globals().update(config_reloader.config)
+    coin_table = CoinTable(coin_values)
     
-    # Start the keyboard monitoring thread AFTER initialization only if not running as a service
-    if not is_service():
-        keyboard_thread = threading.Thread(target=keyboard_monitor)
-        keyboard_thread.daemon = True
-        keyboard_thread.start()
-        print("System ready! Press '1' to activate button 1, '2' to activate button 2, 'q' to quit")
-    else:
-        print("Running in service mode - keyboard control disabled")
+    # Setup GPIO pins
+    for name in INPUT_PINS + RELAY_PINS + LED_PINS:
+        setup_pin(name, globals()[name])
     
-    last_state = GPIO.input(COIN_PIN)
-    update_button_status()
-    
-    while running:
-        # Check IR sensors
-        check_ir_sensors()
+    metrics = MetricStore(METRICS_DIR)
+    telemetry = DispenseTelemetry((1, 2), TELEMETRY_FILE, default_timeout=10.0, log=log)
+    state_store = StateStore(STATE_FILE)
+    status_server = StatusServer({
+        "/status": get_status,
+        "/transactions": get_transactions,
+        "/health": get_health,
+    }, port=STATUS_PORT, log=log, query_routes={"/metrics": get_metrics})
+
+def main():
+    global running, pulse_count, last_pulse_time, firebase_thread, command_listener, coin_thread, sync_thread
+    setup()
         
-        # Check for coin pulses
-        current_state = GPIO.input(COIN_PIN)
-        current_time = time.time()
+    try:
+        log.info("System initializing...")
+        # Reload settings on SIGHUP (systemctl reload vendo)
+        config_reloader.install_signal_handler()
+        sdnotify.notify("STATUS=Initializing")
+        display_message("Napkin Vendo", "Initializing...")
         
-        # Detect signal change (coin pulse)
-        if last_state == GPIO.HIGH and current_state == GPIO.LOW:
-            # New sequence or continuing current coin?
-            if current_time - last_pulse_time > 0.5:
-                # Process previous coin if exists
-                if pulse_count > 0:
-                    if pulse_count in coin_values:
-                        coin_value = coin_values[pulse_count]
-                        total_value += coin_value
-                        print(f"Coin detected: ₱{coin_value:.2f}, Total: ₱{total_value:.2f}")
-                        display_message(f"Coin: P{coin_value:.2f}", f"Total: P{total_value:.2f}")
-                        update_button_status()
-                        
-                        # Update money collected in Firebase
-                        update_money_collected(coin_value)
-                    else:
-                        print(f"Unknown coin: {pulse_count} pulses")
-                        display_message("Unknown Coin", f"{pulse_count} pulses")
-                pulse_count = 0
-            
-            # Count this pulse
-            pulse_count += 1
-            last_pulse_time = current_time
-            print(f"Pulse detected: {pulse_count}")
+        # Log if running as a service
+        if is_service():
+            log.info("Running in service mode - keyboard control disabled")
         
-        last_state = current_state
+        log.info("Connecting to Firebase...")
+        sdnotify.notify("STATUS=Connecting to Firebase")
         
-        # Process coin after timeout (no pulses for a while)
-        if pulse_count > 0 and current_time - last_pulse_time > 0.5:
-            if pulse_count in coin_values:
-                coin_value = coin_values[pulse_count]
-                total_value += coin_value
-                print(f"Coin detected: ₱{coin_value:.2f}, Total: ₱{total_value:.2f}")
-                display_message(f"Coin: P{coin_value:.2f}", f"Total: P{total_value:.2f}")
-                update_button_status()
-                
-                # Update money collected in Firebase
-                update_money_collected(coin_value)
-            else:
-                print(f"Unknown coin: {pulse_count} pulses")
-                display_message("Unknown Coin", f"{pulse_count} pulses")
-            pulse_count = 0
+        # Restore credit and inventory from before the last restart
+        restore_state()
+        
+        # Initialize Firebase connection
+        firebase_ready = initialize_firebase()
+        if not firebase_ready:
+            log.warning("Firebase connection failed. System will run in offline mode.")
+            display_message("Offline Mode", "No connection")
+        
+        # Coin side effects run off the coin loop
+        coin_thread = threading.Thread(target=coin_worker)
+        coin_thread.daemon = True
+        coin_thread.start()
+        sync_thread = threading.Thread(target=sync_worker)
+        sync_thread.daemon = True
+        sync_thread.start()
+        
+        # Start Firebase monitoring thread
+        firebase_thread = threading.Thread(target=check_firebase_updates)
+        firebase_thread.daemon = True
+        firebase_thread.start()
         
-        # Check for physical button presses
-        if GPIO.input(BUTTON1_PIN) == GPIO.LOW:  # Button 1 pressed (LOW because of pull-up)
-            print("Physical button 1 pressed")
-            activate_relay1()
-            time.sleep(0.5)  # Debounce delay
+        # Store coin loop timing history
+        metrics_thread = threading.Thread(target=record_loop_metrics)
+        metrics_thread.daemon = True
+        metrics_thread.start()
+        
+        # Serve live status to the local network
+        status_server.start()
+        
+        # Start listening for remote commands
+        command_listener = CommandListener(FIREBASE_HOST, MACHINE_ID, REMOTE_COMMANDS, log).start()
+        
+        log.info("Coin detector active. Insert coins...")
+        display_message("Ready", "Insert coins")
+        log.info("Minimum amount required: ₱%.2f", MINIMUM_AMOUNT)
+        log.info("IR sensors active. Will stop relays when objects are detected.")
+        
+        # Start the keyboard monitoring thread AFTER initialization only if not running as a service
+        if not is_service():
+            keyboard_thread = threading.Thread(target=keyboard_monitor)
+            keyboard_thread.daemon = True
+            keyboard_thread.start()
+            log.info("System ready! Press '1' to activate button 1, '2' to activate button 2, 'q' to quit")
+        else:
+            log.info("Running in service mode - keyboard control disabled")
+        
+        last_state = GPIO.input(COIN_PIN)
+        update_button_status()
+        loop_monitor.start()
+        # systemd watchdog pings only while the coin loop keeps to its budget
+        sdnotify.start_watchdog(loop_monitor.healthy, log)
+        sd_ready = False
+        # Buttons are debounced by ignoring them for a while after a press, so coin pulses keep being sampled
+        button1_ready_at = button2_ready_at = 0
+        
+        while running:
+            loop_monitor.tick()
+            
+            # Swap in reloaded settings between coins and vends only
+            coin_pin = COIN_PIN
+            if (config_reloader.poll(idle=pulse_count == 0 and not coin_events
+                                     and not relay1_active and not relay2_active)
+                    and COIN_PIN != coin_pin):
+                # Start sampling the new pin from its current level
+                last_state = GPIO.input(COIN_PIN)
             
-        if GPIO.input(BUTTON2_PIN) == GPIO.LOW:  # Button 2 pressed
-            print("Physical button 2 pressed")
-            activate_relay2()
-            time.sleep(0.5)  # Debounce delay
+            # Check for coin pulses
+            current_state = GPIO.input(COIN_PIN)
+            current_time = time.time()
             
-        time.sleep(0.01)  # Reduce CPU usage
+            # Detect signal change (coin pulse)
+            if last_state == GPIO.HIGH and current_state == GPIO.LOW:
+                # New sequence or continuing current coin?
+                if current_time - last_pulse_time > COIN_TIMEOUT:
+                    # Process previous coin if exists
+                    if pulse_count > 0:
+                        credit_coin(pulse_count)
+                    pulse_count = 0
+                
+                # Count this pulse
+                pulse_count += 1
+                last_pulse_time = current_time
+                log.debug("Pulse detected: %s", pulse_count)
+            
+            last_state = current_state
+            
+            # Process coin after timeout (no pulses for a while)
+            if pulse_count > 0 and current_time - last_pulse_time > COIN_TIMEOUT:
+                credit_coin(pulse_count)
+                pulse_count = 0
+            
+            # Check for physical button presses
+            if current_time >= button1_ready_at and GPIO.input(BUTTON1_PIN) == GPIO.LOW:  # Button 1 pressed (LOW because of pull-up)
+                log.info("Physical button 1 pressed")
+                activate_relay1()
+                button1_ready_at = time.time() + 0.5  # Debounce delay
+                
+            if current_time >= button2_ready_at and GPIO.input(BUTTON2_PIN) == GPIO.LOW:  # Button 2 pressed
+                log.info("Physical button 2 pressed")
+                activate_relay2()
+                button2_ready_at = time.time() + 0.5  # Debounce delay
+            
+            # Keyboard presses, activated here so only the coin loop spends credit
+            while keyboard_presses:
+                if keyboard_presses.popleft() == 1:
+                    activate_relay1()
+                else:
+                    activate_relay2()
+            credit_refunds()
+                
+            # Tell systemd we are up once the first coin sample has been taken
+            if not sd_ready:
+                sdnotify.notify("READY=1\nSTATUS=Accepting coins")
+                sd_ready = True
+            
+            time.sleep(0.01)  # Reduce CPU usage
 
-except KeyboardInterrupt:
-    print("Program interrupted")
-    display_message("Interrupted", "Shutting down")
-finally:
-    running = False
-    # Final update to Firebase before exit
-    update_system_status()
-    time.sleep(0.5)  # Give threads time to close
-    
-    # Clear and turn off LCD
-    try:
-        lcd.clear()
-        lcd.backlight_enabled = False
-    except:
-        pass
+    except KeyboardInterrupt:
+        log.info("Program interrupted")
+        display_message("Interrupted", "Shutting down")
+    finally:
+        running = False
+        sdnotify.notify("STOPPING=1")
+        loop_monitor.stop()
+        if command_listener:
+            command_listener.stop()
+        # Let queued coins finish before the final update
+        coin_ready.set()
+        if coin_thread:
+            coin_thread.join(timeout=5)
+        sync_ready.set()
+        if sync_thread:
+            sync_thread.join(timeout=5)
+        # Final update to Firebase before exit
+        update_system_status()
+        time.sleep(0.5)  # Give threads time to close
         
-    GPIO.cleanup()
-    print("Program ended. GPIO cleaned up.")
\ No newline at end of file
+        # Clear and turn off LCD
+        try:
+            lcd.clear()
+            lcd.backlight_enabled = False
+        except:
+            pass
+            
+        save_state()  # Credit from coins still queued at exit
+        state_store.close()
+        metrics.close()
+        GPIO.cleanup()
+        log.info("Program ended. GPIO cleaned up.")
+        log.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Unix-domain socket command interface
+Lets scripts drive the machine through the same command path as the
+console. Each request is one line of JSON:
+    {"id": 1, "commands": ["coin10", "settle", "nap-1", "state"]}
+and gets one line of JSON back:
+    {"id": 1, "results": [{"command": "coin10", "result": "pulses",
+     "elapsed_us": 41}, ...], "state": {...}, "elapsed_us": 2050}
+A plain text line is treated as a single command. Commands in one request
+run back to back without other socket clients interleaving.
+
+Run this file as a client:
+    python3 command_socket.py coin10 settle nap-1 state
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+DEFAULT_SOCKET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendo.sock")
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Read requests line by line and answer each with a JSON reply"""
+
+    def handle(self):
+        server = self.server
+        for line in self.rfile:
+            line = line.decode("utf-8").strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line) if line.startswith(("{", "[")) else {"commands": [line]}
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+                commands = request.get("commands", [])
+                if isinstance(commands, str):
+                    commands = [commands]
+                if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+                    raise ValueError("commands must be a string or a list of strings")
+                reply = server.run_batch(commands)
+                reply["id"] = request.get("id")
+            except ValueError as e:
+                reply = {"id": None, "error": f"Invalid request: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+class CommandSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Socket server that runs command batches through 'execute'"""
+
+    daemon_threads = True
+
+    def __init__(self, path, execute, get_state, lock=None):
+        self.path = path
+        self.execute = execute
+        self.get_state = get_state
+        self.lock = lock or threading.Lock()
+        # Remove a socket left behind by a previous run
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, CommandHandler)
+        os.chmod(path, 0o660)
+
+    def run_batch(self, commands):
+        results = []
+        batch_start = time.perf_counter()
+        with self.lock:
+            for command in commands:
+                start = time.perf_counter()
+                if command == "state":
+                    result = "ok"
+                else:
+                    try:
+                        result = self.execute(command)
+                    except Exception as e:
+                        result = f"error: {e}"
+                results.append({
+                    "command": command,
+                    "result": result,
+                    "elapsed_us": int((time.perf_counter() - start) * 1e6),
+                })
+            state = self.get_state()
+        return {
+            "results": results,
+            "state": state,
+            "elapsed_us": int((time.perf_counter() - batch_start) * 1e6),
+        }
+
+    def start(self):
+        """Serve clients from a background thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+def send_commands(commands, path=DEFAULT_SOCKET, request_id=None):
+    """Send one batch of commands and return the decoded reply"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        request = {"id": request_id, "commands": list(commands)}
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    return json.loads(reply)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: command_socket.py COMMAND [COMMAND ...]")
+        sys.exit(1)
+    print(json.dumps(send_commands(sys.argv[1:], os.environ.get("VENDO_SOCKET", DEFAULT_SOCKET)), indent=2))
@@ -0,0 +1,182 @@
+"""
+Validated settings file with live reload
+Settings start from the defaults in the script and are overridden by a
+JSON file. Every key in the file must exist in the defaults and keep its
+type, and the script's own check (distinct pins, positive prices, ...)
+must pass, otherwise the whole file is rejected and the running settings
+stay in place.
+
+A reload is requested with SIGHUP (systemctl reload vendo) or remotely
+through update(), and applied by the main loop between iterations once
+it is idle (no coin half counted, nothing dispensing), so new values
+never land in the middle of a coin or a vend:
+    reloader = ConfigReloader(path, DEFAULTS, apply_config, validate_config)
+    reloader.install_signal_handler()
+    while running:
+        reloader.poll(idle=pulse_count == 0 and not dispensing)
+"""
+
+import json
+import os
+import signal
+import threading
+
+class ConfigError(ValueError):
+    """Raised when a settings file or update is invalid"""
+
+def _coerce(key, value, default):
+    """Convert a JSON value to the type of its default"""
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise ConfigError(f"{key} must be true or false")
+        return value
+    if isinstance(default, int):
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+            raise ConfigError(f"{key} must be a whole number")
+        return int(value)
+    if isinstance(default, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ConfigError(f"{key} must be a number")
+        return float(value)
+    if isinstance(default, dict):
+        if not isinstance(value, dict) or not value:
+            raise ConfigError(f"{key} must be a non-empty object")
+        # JSON object keys are strings: convert them like the default's keys
+        sample_key, sample_value = next(iter(default.items()))
+        try:
+            return {_coerce(key, type(sample_key)(k), sample_key): _coerce(f"{key}[{k}]", v, sample_value)
+                    for k, v in value.items()}
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"{key}: {e}")
+    if not isinstance(value, type(default)):
+        raise ConfigError(f"{key} must be a {type(default).__name__}")
+    return value
+
+def parse_config(data, defaults, validate=None):
+    """Defaults overridden by 'data', type-checked and validated"""
+    if not isinstance(data, dict):
+        raise ConfigError("Settings must be a JSON object")
+    unknown = sorted(set(data) - set(defaults))
+    if unknown:
+        raise ConfigError(f"Unknown settings: {', '.join(unknown)}")
+    config = dict(defaults)
+    for key, value in data.items():
+        config[key] = _coerce(key, value, defaults[key])
+    if validate:
+        validate(config)
+    return config
+
+def read_overrides(path):
+    """Raw settings from the file ({} if there is no file)"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        raise ConfigError(f"{path} is not valid JSON: {e}")
+
+def load_config(path, defaults, validate=None):
+    return parse_config(read_overrides(path), defaults, validate)
+
+def write_overrides(path, data):
+    """Replace the file atomically, so a crash leaves either the old or the new file"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def require_distinct_pins(config, keys):
+    pins = [config[key] for key in keys]
+    for key in keys:
+        if not 0 <= config[key] <= 27:
+            raise ConfigError(f"{key} must be a BCM pin number (0-27)")
+    if len(set(pins)) != len(pins):
+        raise ConfigError("Every pin must be different")
+
+def require_positive(config, *keys):
+    for key in keys:
+        value = config[key]
+        values = list(value.keys()) + list(value.values()) if isinstance(value, dict) else [value]
+        if any(v <= 0 for v in values):
+            raise ConfigError(f"{key} must be positive")
+
+class ConfigReloader:
+    """Holds the current settings and swaps in new ones when the loop is idle"""
+
+    def __init__(self, path, defaults, apply, validate=None, log=None):
+        self.path = path
+        self.defaults = defaults
+        self.apply = apply  # apply(config, changed_keys), called from the main loop
+        self.validate = validate
+        self.log = log
+        self.lock = threading.Lock()
+        self.pending = False
+        self.reloads = 0
+        try:
+            self.config = load_config(path, defaults, validate)
+        except ConfigError as e:
+            self._report("error", "Ignoring settings file: %s", e)
+            self.config = parse_config({}, defaults, validate)
+
+    def _report(self, level, message, *args):
+        if self.log:
+            getattr(self.log, level)(message, *args)
+        else:
+            print(message % args)
+
+    def request(self):
+        """Ask for a reload at the next idle loop iteration (safe in signal handlers)"""
+        self.pending = True
+
+    def install_signal_handler(self):
+        """Reload on SIGHUP (must be called from the main thread)"""
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.request())
+
+    def update(self, changes):
+        """Validate and save changed settings, then schedule a reload
+
+        Raises ConfigError without touching the file if the result would be
+        invalid. Returns the settings that will be applied.
+        """
+        with self.lock:
+            data = read_overrides(self.path)
+            data.update(changes)
+            config = parse_config(data, self.defaults, self.validate)
+            write_overrides(self.path, data)
+        self.request()
+        return config
+
+    def poll(self, idle=True):
+        """Apply a requested reload if the loop is idle; True if settings changed"""
+        if not self.pending or not idle:
+            return False
+        self.pending = False
+        try:
+            config = load_config(self.path, self.defaults, self.validate)
+        except (ConfigError, OSError) as e:
+            self._report("error", "Settings not reloaded: %s", e)
+            return False
+        changed = {key for key in config if config[key] != self.config[key]}
+        if not changed:
+            self._report("info", "Settings reloaded: no changes")
+            return False
+        previous, self.config = self.config, config
+        try:
+            self.apply(config, changed)
+        except Exception as e:
+            # Put the old settings back rather than run half-applied
+            self._report("error", "Applying settings failed (%s) - restoring the previous ones", e)
+            self.config = previous
+            try:
+                self.apply(previous, changed)
+            except Exception as e:
+                # Keep the loop running; the next successful reload fixes it up
+                self._report("error", "Restoring the previous settings failed too: %s", e)
+            return True
+        self.reloads += 1
+        self._report("info", "Settings reloaded: %s", ", ".join(sorted(changed)))
+        return True
@@ -0,0 +1,257 @@
+"""
+Dispense timing telemetry and jam prediction
+For every vend the dispenser records, per channel:
+- motor-on to IR-break time (how long the spiral took to drop the item)
+- IR pulse width (how long the item blocked the beam)
+- whether it timed out
+Times go into streaming histograms and two EWMAs each: a fast one that
+follows the last few vends and a slow baseline. A spiral that is wearing
+out or a stack that is binding shows up as the fast average drifting
+above the baseline, well before it starts timing out, so the channel is
+flagged "degrading" while it still works.
+
+The dispense timeout adapts to each channel's own distribution instead
+of a fixed 10 s: twice the slower of the p99 and the recent average,
+kept between MIN_TIMEOUT and MAX_TIMEOUT (or a lower cap given by the
+script).
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# Histogram bucket upper bounds: 10 ms doubling every 4 buckets, up to ~40 s
+BUCKET_BOUNDS = [0.01 * 2 ** (i / 4) for i in range(49)]
+
+MIN_SAMPLES = 10       # Vends before the timeout adapts and health is judged
+FAST_ALPHA = 0.3       # Recent average: about the last 5 vends
+SLOW_ALPHA = 0.02      # Baseline: about the last 100 vends
+TIMEOUT_ALPHA = 0.1    # Timeout rate: about the last 10 attempts
+DRIFT_RATIO = 1.3      # Recent IR time 30% over baseline = degrading
+TIMEOUT_RATE_WARN = 0.05
+TIMEOUT_RATE_FAIL = 0.2
+TIMEOUT_MARGIN = 2.0
+MIN_TIMEOUT = 3.0
+MAX_TIMEOUT = 20.0
+
+class Histogram:
+    """Log-bucketed streaming histogram"""
+
+    def __init__(self, counts=None):
+        self.counts = list(counts) if counts else [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = sum(self.counts)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+        self.total += 1
+
+    def percentile(self, fraction):
+        """Approximate percentile (upper bound of its bucket, seconds)"""
+        if not self.total:
+            return 0.0
+        target = fraction * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return BUCKET_BOUNDS[min(i, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+class Ewma:
+    """Fast and slow exponentially weighted averages of one measurement"""
+
+    def __init__(self, fast=None, slow=None, samples=0):
+        self.fast = fast
+        self.slow = slow
+        self.samples = samples
+
+    def add(self, value):
+        self.samples += 1
+        # Plain mean until there are enough samples, so the first vend does not set the baseline
+        fast_alpha = max(FAST_ALPHA, 1 / self.samples)
+        slow_alpha = max(SLOW_ALPHA, 1 / self.samples)
+        self.fast = value if self.fast is None else self.fast + fast_alpha * (value - self.fast)
+        self.slow = value if self.slow is None else self.slow + slow_alpha * (value - self.slow)
+
+    def drift(self):
+        """Recent average over baseline (1.0 = no change)"""
+        if not self.slow:
+            return 1.0
+        return self.fast / self.slow
+
+class ChannelTelemetry:
+    """Timing history and health of one dispense channel"""
+
+    def __init__(self, name, default_timeout=10.0, data=None, max_timeout=MAX_TIMEOUT):
+        self.name = name
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        data = data or {}
+        self.ir_times = Histogram(data.get("ir_time_counts"))
+        self.pulse_widths = Histogram(data.get("pulse_width_counts"))
+        self.ir_time = Ewma(*data.get("ir_time_ewma", ()))
+        self.pulse_width = Ewma(*data.get("pulse_width_ewma", ()))
+        self.vends = data.get("vends", 0)
+        self.timeouts = data.get("timeouts", 0)
+        self.timeout_rate = data.get("timeout_rate", 0.0)  # EWMA of 1 per timeout, 0 per vend
+        self.health = self.assess()
+
+    def record_vend(self, ir_time, pulse_width=None):
+        self.vends += 1
+        self.ir_times.add(ir_time)
+        self.ir_time.add(ir_time)
+        if pulse_width is not None:
+            self.pulse_widths.add(pulse_width)
+            self.pulse_width.add(pulse_width)
+        self.timeout_rate += TIMEOUT_ALPHA * (0 - self.timeout_rate)
+
+    def record_timeout(self):
+        self.timeouts += 1
+        self.timeout_rate += TIMEOUT_ALPHA * (1 - self.timeout_rate)
+
+    def timeout(self):
+        """Seconds to run the motor before giving up on this channel"""
+        if self.vends < MIN_SAMPLES:
+            return min(self.default_timeout, self.max_timeout)
+        expected = max(self.ir_times.percentile(0.99), self.ir_time.fast)
+        return min(max(expected * TIMEOUT_MARGIN, MIN_TIMEOUT), self.max_timeout)
+
+    def assess(self):
+        """'learning', 'ok', 'degrading' (drifting, still dispensing) or 'failing'"""
+        if self.vends + self.timeouts < MIN_SAMPLES:
+            return "learning"
+        if self.timeout_rate >= TIMEOUT_RATE_FAIL:
+            return "failing"
+        width_drift = self.pulse_width.drift()
+        if (self.timeout_rate >= TIMEOUT_RATE_WARN or self.ir_time.drift() >= DRIFT_RATIO
+                or self.pulse_width.samples >= MIN_SAMPLES
+                and not 1 / DRIFT_RATIO < width_drift < DRIFT_RATIO):
+            return "degrading"
+        return "ok"
+
+    def stats(self):
+        return {
+            "health": self.health,
+            "vends": self.vends,
+            "timeouts": self.timeouts,
+            "timeout_rate": round(self.timeout_rate, 3),
+            "timeout_s": round(self.timeout(), 2),
+            "ir_time_p50_s": self.ir_times.percentile(0.5),
+            "ir_time_p99_s": self.ir_times.percentile(0.99),
+            "ir_time_recent_s": self.ir_time.fast,
+            "ir_time_baseline_s": self.ir_time.slow,
+            "ir_time_drift": round(self.ir_time.drift(), 3),
+            "pulse_width_p50_s": self.pulse_widths.percentile(0.5),
+            "pulse_width_drift": round(self.pulse_width.drift(), 3),
+        }
+
+    def to_dict(self):
+        return {
+            "ir_time_counts": self.ir_times.counts,
+            "pulse_width_counts": self.pulse_widths.counts,
+            "ir_time_ewma": [self.ir_time.fast, self.ir_time.slow, self.ir_time.samples],
+            "pulse_width_ewma": [self.pulse_width.fast, self.pulse_width.slow, self.pulse_width.samples],
+            "vends": self.vends,
+            "timeouts": self.timeouts,
+            "timeout_rate": self.timeout_rate,
+        }
+
+class DispenseTelemetry:
+    """Telemetry for all channels, saved to a JSON file after every vend"""
+
+    def __init__(self, channels, path=None, default_timeout=10.0, log=None, max_timeout=MAX_TIMEOUT):
+        self.path = path
+        self.log = log
+        self.max_timeout = max_timeout
+        self.lock = threading.Lock()
+        saved = {}
+        if path:
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+            except FileNotFoundError:
+                pass
+            except (ValueError, OSError) as e:
+                self._report("warning", "Dispense telemetry not loaded: %s", e)
+        self.channels = {}
+        for name in channels:
+            try:
+                self.channels[name] = ChannelTelemetry(name, default_timeout, saved.get(str(name)), max_timeout)
+            except (TypeError, ValueError):
+                self.channels[name] = ChannelTelemetry(name, default_timeout, max_timeout=max_timeout)
+
+    def _report(self, level, message, *args):
+        if self.log:
+            getattr(self.log, level)(message, *args)
+        else:
+            print(message % args)
+
+    def timeout(self, name):
+        return self.channels[name].timeout()
+
+    def health(self, name):
+        return self.channels[name].health
+
+    def record_vend(self, name, ir_time, pulse_width=None):
+        with self.lock:
+            self.channels[name].record_vend(ir_time, pulse_width)
+            self._update(name)
+
+    def record_timeout(self, name):
+        with self.lock:
+            self.channels[name].record_timeout()
+            self._update(name)
+
+    def _update(self, name):
+        channel = self.channels[name]
+        health = channel.assess()
+        if health != channel.health:
+            level = "warning" if health in ("degrading", "failing") else "info"
+            self._report(level, "Dispenser %s is now %s (IR time %.2f s vs %.2f s baseline, %.0f%% timeouts)",
+                         name, health, channel.ir_time.fast or 0, channel.ir_time.slow or 0,
+                         channel.timeout_rate * 100)
+            channel.health = health
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        data = {str(name): channel.to_dict() for name, channel in self.channels.items()}
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            self._report("warning", "Dispense telemetry not saved: %s", e)
+
+    def stats(self):
+        with self.lock:
+            return {str(name): channel.stats() for name, channel in self.channels.items()}
+
+def wait_for_ir(is_blocked, timeout, run_on=0.0, poll_interval=0.01):
+    """Poll an IR sensor while the motor runs
+
+    Waits up to 'timeout' seconds for the beam to be blocked, then keeps
+    polling for 'run_on' seconds (the motor finishing its turn) to time
+    how long the item blocked it. Returns (ir_time, pulse_width):
+    ir_time is None on timeout, pulse_width is None if the beam was still
+    blocked when the run-on ended.
+    """
+    start = time.monotonic()
+    while not is_blocked():
+        if time.monotonic() - start >= timeout:
+            return None, None
+        time.sleep(poll_interval)
+    detected = time.monotonic()
+    ir_time = detected - start
+    pulse_width = None
+    while True:
+        now = time.monotonic()
+        if pulse_width is None and not is_blocked():
+            pulse_width = now - detected
+        if now - detected >= run_on:
+            return ir_time, pulse_width
+        time.sleep(poll_interval)
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Local Firebase Realtime Database emulator
+Serves the subset of the RTDB REST API used by the vending machine so it
+can be exercised offline:
+- GET, PUT, PATCH, POST (push IDs) and DELETE on any '<path>.json'
+- ETags ('X-Firebase-ETag: true') and conditional writes ('if-match')
+- Streaming ('Accept: text/event-stream') with put/patch events
+Faults can be injected to see how the sync path degrades:
+- latency: fixed delay plus random jitter on every request
+- error_rate: fraction of requests answered with a 5xx error
+- timeout_rate: fraction of requests that hang and then get dropped
+- lost_reply_rate: fraction of requests that are carried out (writes
+  commit) but whose response is dropped, so a client cannot tell them
+  from a failed request
+- partition: every request is dropped without a response
+
+Run standalone:
+    python3 firebase_emulator.py --port 9000 --latency 0.05 --error-rate 0.02
+and point the machine at it:
+    FIREBASE_HOST=http://127.0.0.1:9000 python3 coinslot.py
+
+Faults and counters can be changed or read while running through
+'/.emulator/faults' (GET/PUT/PATCH) and '/.emulator/stats' (GET).
+"""
+
+import argparse
+import hashlib
+import json
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from firebase_tx import PushIdGenerator
+
+KEEP_ALIVE_INTERVAL = 30  # Seconds between keep-alive events on idle streams
+
+DEFAULT_FAULTS = {
+    "latency": 0.0,       # Fixed delay added to every request (seconds)
+    "jitter": 0.0,        # Extra random delay, uniform in [0, jitter] (seconds)
+    "error_rate": 0.0,    # Probability of answering with a 5xx error
+    "error_codes": [500, 503],
+    "timeout_rate": 0.0,  # Probability of hanging and dropping the request
+    "hang_time": 30.0,    # How long a timed-out request hangs (seconds)
+    "lost_reply_rate": 0.0,  # Probability of carrying out the request and dropping the response
+    "partition": False,   # Drop every request without a response
+    "paths": None,        # Only inject faults on paths starting with one of these
+}
+
+def split_path(path):
+    """Split a '/a/b.json' request path into its node segments"""
+    path = urlsplit(path).path
+    if path.endswith(".json"):
+        path = path[:-len(".json")]
+    return [part for part in path.split("/") if part]
+
+def relative_path(base, path):
+    """Return 'path' relative to 'base' as a Firebase event path, or None"""
+    if path[:len(base)] != base:
+        return None
+    return "/" + "/".join(path[len(base):])
+
+def compute_etag(value):
+    """Compute a stable ETag for a node value"""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+class Database:
+    """In-memory JSON tree with Firebase write semantics and listeners"""
+
+    def __init__(self, data=None):
+        self.root = data
+        self.lock = threading.RLock()
+        self.listeners = []  # (path segments, event queue)
+
+    def get(self, path):
+        with self.lock:
+            node = self.root
+            for key in path:
+                if not isinstance(node, dict) or key not in node:
+                    return None
+                node = node[key]
+            return json.loads(json.dumps(node))
+
+    def _set(self, path, value):
+        """Set a node, creating parents and pruning empty branches"""
+        if isinstance(value, dict):
+            value = {k: v for k, v in value.items() if v is not None} or None
+        if not path:
+            self.root = value
+            return
+        if not isinstance(self.root, dict):
+            if value is None:
+                return
+            self.root = {}
+        parents = [self.root]
+        node = self.root
+        for key in path[:-1]:
+            child = node.get(key)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[key] = {}
+            parents.append(child)
+            node = child
+        if value is None:
+            node.pop(path[-1], None)
+            # Remove parents that became empty
+            for depth in range(len(path) - 1, 0, -1):
+                if parents[depth]:
+                    break
+                parents[depth - 1].pop(path[depth - 1], None)
+            if not self.root:
+                self.root = None
+        else:
+            node[path[-1]] = value
+
+    def put(self, path, value, if_match=None):
+        """Replace a node; returns (ok, current etag, current value)"""
+        with self.lock:
+            current = self.get(path)
+            if if_match is not None and if_match != compute_etag(current):
+                return False, compute_etag(current), current
+            self._set(path, value)
+            self._notify("put", path, value)
+            value = self.get(path)
+            return True, compute_etag(value), value
+
+    def patch(self, path, children):
+        """Update several children of a node at once"""
+        with self.lock:
+            for key, value in children.items():
+                self._set(path + split_path(key), value)
+            self._notify("patch", path, children)
+
+    def add_listener(self, path):
+        events = queue.Queue()
+        with self.lock:
+            self.listeners.append((path, events))
+            events.put(("put", {"path": "/", "data": self.get(path)}))
+        return events
+
+    def remove_listener(self, events):
+        with self.lock:
+            self.listeners = [l for l in self.listeners if l[1] is not events]
+
+    def drop_listeners(self):
+        """Close every open stream (used to simulate a partition)"""
+        with self.lock:
+            for _, events in self.listeners:
+                events.put(None)
+            self.listeners = []
+
+    def _notify(self, event, path, data):
+        for listen_path, events in self.listeners:
+            rel = relative_path(listen_path, path)
+            if rel is not None:
+                # Write at or below the listener
+                events.put((event, {"path": rel, "data": data}))
+            elif relative_path(path, listen_path) is not None:
+                # Write above the listener replaces its whole subtree
+                events.put(("put", {"path": "/", "data": self.get(listen_path)}))
+
+class EmulatorHandler(BaseHTTPRequestHandler):
+    """HTTP handler implementing the RTDB REST surface"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.emulator.verbose:
+            super().log_message(format, *args)
+
+    # Request entry points
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_PATCH(self):
+        self.handle_request("PATCH")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+    def handle_request(self, method):
+        emulator = self.server.emulator
+        body = self.read_body()
+        self.lose_reply = False
+        if self.path.startswith("/.emulator/"):
+            self.handle_control(method, body)
+            return
+        emulator.count("requests", method)
+
+        fault = emulator.pick_fault(self.path)
+        if fault == "lost_reply":
+            self.lose_reply = True
+            # Carried out below; send_json then drops the response
+            emulator.count("faults", "lost_reply")
+        elif fault == "partition":
+            emulator.count("faults", "partition")
+            self.close_connection = True
+            return
+        elif fault == "timeout":
+            emulator.count("faults", "timeout")
+            time.sleep(emulator.faults["hang_time"])
+            self.close_connection = True
+            return
+        elif fault is not None:
+            emulator.count("faults", str(fault))
+            self.send_json(fault, {"error": "Injected server error"})
+            return
+
+        path = split_path(self.path)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            self.send_json(400, {"error": "Invalid data; couldn't parse JSON object."})
+            return
+
+        db = emulator.db
+        want_etag = self.headers.get("X-Firebase-ETag", "").lower() == "true"
+        if_match = self.headers.get("if-match")
+
+        if method == "GET":
+            if "text/event-stream" in self.headers.get("Accept", ""):
+                if self.lose_reply:
+                    self.close_connection = True
+                else:
+                    self.stream(path)
+                return
+            value = db.get(path)
+            self.send_json(200, value, compute_etag(value) if want_etag else None)
+        elif method in ("PUT", "DELETE"):
+            ok, etag, value = db.put(path, data if method == "PUT" else None, if_match)
+            if not ok:
+                emulator.count("conflicts", method)
+                self.send_json(412, value, etag)
+            else:
+                self.send_json(200, value, etag if want_etag or if_match else None)
+        elif method == "PATCH":
+            if not isinstance(data, dict):
+                self.send_json(400, {"error": "Invalid data; couldn't parse JSON object."})
+                return
+            db.patch(path, data)
+            self.send_json(200, data)
+        elif method == "POST":
+            name = emulator.push_ids.next_id()
+            db.put(path + [name], data)
+            self.send_json(200, {"name": name})
+
+    def handle_control(self, method, body):
+        """Read or change emulator settings at runtime"""
+        emulator = self.server.emulator
+        name = split_path(self.path)[-1]
+        if name == "faults":
+            if method in ("PUT", "PATCH"):
+                try:
+                    changes = json.loads(body) if body else {}
+                    emulator.set_faults(replace=(method == "PUT"), **changes)
+                except (ValueError, TypeError) as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+            self.send_json(200, emulator.faults)
+        elif name == "stats":
+            self.send_json(200, emulator.stats())
+        else:
+            self.send_json(404, {"error": "Unknown emulator endpoint"})
+
+    def stream(self, path):
+        """Serve a text/event-stream of changes below 'path'"""
+        emulator = self.server.emulator
+        events = emulator.db.add_listener(path)
+        emulator.count("streams", "opened")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while not emulator.stopping.is_set():
+                try:
+                    item = events.get(timeout=emulator.keep_alive_interval)
+                except queue.Empty:
+                    item = ("keep-alive", None)
+                if item is None:
+                    break
+                event, data = item
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            emulator.db.remove_listener(events)
+            emulator.count("streams", "closed")
+
+    # Helpers
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode("utf-8") if length else ""
+
+    def send_json(self, status, value, etag=None):
+        if self.lose_reply:
+            self.close_connection = True
+            return
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+class FirebaseEmulator:
+    """Local RTDB REST server with configurable fault injection"""
+
+    def __init__(self, host="127.0.0.1", port=0, data=None, faults=None, seed=None, verbose=False):
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.db = Database(data)
+        self.push_ids = PushIdGenerator(self.rng)
+        self.faults = dict(DEFAULT_FAULTS)
+        self.set_faults(**(faults or {}))
+        self.verbose = verbose
+        self.keep_alive_interval = KEEP_ALIVE_INTERVAL
+        self.stopping = threading.Event()
+        self.counters = {}
+        self.counters_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), EmulatorHandler)
+        self.server.daemon_threads = True
+        self.server.emulator = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests from a background thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.db.drop_listeners()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def set_faults(self, replace=False, **changes):
+        """Update fault settings; unknown names raise ValueError"""
+        unknown = set(changes) - set(DEFAULT_FAULTS)
+        if unknown:
+            raise ValueError(f"Unknown fault settings: {', '.join(sorted(unknown))}")
+        faults = dict(DEFAULT_FAULTS) if replace else dict(self.faults)
+        faults.update(changes)
+        self.faults = faults
+        if faults["partition"]:
+            self.db.drop_listeners()
+
+    def pick_fault(self, path):
+        """Apply latency and decide which fault, if any, hits this request"""
+        faults = self.faults
+        if faults["paths"] and not any(urlsplit(path).path.startswith(p) for p in faults["paths"]):
+            return None
+        with self.rng_lock:
+            delay = faults["latency"] + self.rng.uniform(0, faults["jitter"])
+            roll = self.rng.random()
+            code = self.rng.choice(faults["error_codes"])
+        if faults["partition"]:
+            return "partition"
+        if delay > 0:
+            time.sleep(delay)
+        if roll < faults["timeout_rate"]:
+            return "timeout"
+        if roll < faults["timeout_rate"] + faults["error_rate"]:
+            return code
+        if roll < faults["timeout_rate"] + faults["error_rate"] + faults["lost_reply_rate"]:
+            return "lost_reply"
+        return None
+
+    def count(self, group, name):
+        with self.counters_lock:
+            counts = self.counters.setdefault(group, {})
+            counts[name] = counts.get(name, 0) + 1
+
+    def stats(self):
+        with self.counters_lock:
+            return json.loads(json.dumps(self.counters))
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Firebase RTDB emulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--data", help="JSON file with the initial database contents")
+    parser.add_argument("--seed", type=int, help="Random seed for repeatable fault injection")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--hang-time", type=float, default=30.0)
+    parser.add_argument("--lost-reply-rate", type=float, default=0.0,
+                        help="Fraction of requests carried out with their response dropped")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    data = None
+    if args.data:
+        with open(args.data) as f:
+            data = json.load(f)
+    faults = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "timeout_rate": args.timeout_rate,
+        "hang_time": args.hang_time,
+        "lost_reply_rate": args.lost_reply_rate,
+    }
+    emulator = FirebaseEmulator(args.host, args.port, data, faults, args.seed, args.verbose)
+    print(f"Firebase emulator listening on {emulator.url}")
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nEmulator stopped")
+    finally:
+        emulator.stop()
+
+if __name__ == "__main__":
+    main()
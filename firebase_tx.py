@@ -0,0 +1,80 @@
+"""
+Firebase Realtime Database transactions over REST
+Read-modify-write of a single node using ETags: the node is read with
+'X-Firebase-ETag: true' and written back with 'if-match'. If another
+client changed it in between, Firebase answers 412 with the new value and
+ETag, and the update is retried on that value. Only the one node is
+contended, so unrelated writers never wait on each other.
+
+Push IDs are generated on the client too, so a write can be PUT under its
+own key and resent after a lost reply without creating a duplicate.
+"""
+
+import json
+import random
+import string
+import threading
+import time
+
+import requests
+
+# Firebase push ID alphabet (ordered so IDs sort by creation time)
+PUSH_CHARS = "-0123456789" + string.ascii_uppercase + "_" + string.ascii_lowercase
+
+class TransactionError(Exception):
+    """Raised when a transaction cannot be committed"""
+
+def transaction(url, update, max_retries=10, timeout=10, request=requests.request):
+    """Apply 'update(current_value) -> new_value' to the node at 'url'
+
+    Returns the committed value. 'update' may be called several times and
+    must not have side effects. 'request' has the signature of
+    requests.request and can be replaced to instrument the calls.
+    """
+    response = request("GET", url, headers={"X-Firebase-ETag": "true"}, timeout=timeout)
+    if response.status_code != 200:
+        raise TransactionError(f"Read failed. Status code: {response.status_code}")
+    etag = response.headers.get("ETag")
+    value = response.json()
+
+    for attempt in range(max_retries):
+        new_value = update(value)
+        response = request("PUT", url, data=json.dumps(new_value),
+                           headers={"if-match": etag}, timeout=timeout)
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code != 412:
+            raise TransactionError(f"Write failed. Status code: {response.status_code}")
+        # Someone else wrote first: retry on their value after a short random backoff
+        etag = response.headers.get("ETag")
+        value = response.json()
+        time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+    raise TransactionError(f"Gave up after {max_retries} conflicting writes")
+
+class PushIdGenerator:
+    """Generate Firebase-style, time-ordered, 20 character push IDs"""
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.last_time = 0
+        self.last_rand = [0] * 12
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            now = int(time.time() * 1000)
+            if now == self.last_time:
+                # Same millisecond: increment the random part to keep ordering
+                for i in range(11, -1, -1):
+                    if self.last_rand[i] < 63:
+                        self.last_rand[i] += 1
+                        break
+                    self.last_rand[i] = 0
+            else:
+                self.last_time = now
+                self.last_rand = [self.rng.randrange(64) for _ in range(12)]
+            time_chars = []
+            for _ in range(8):
+                time_chars.append(PUSH_CHARS[now % 64])
+                now //= 64
+            return "".join(reversed(time_chars)) + "".join(PUSH_CHARS[i] for i in self.last_rand)
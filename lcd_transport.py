@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Batched I2C transport for HD44780 character LCDs on a PCF8574 backpack
+RPLCD writes every 4-bit nibble as separate SMBus byte writes, so a full
+16x2 redraw costs a few hundred I2C transactions. This driver keeps a copy of
+what is on the screen, encodes only the changed characters (plus the cursor
+moves needed to reach them) into one buffer of expander bytes, and sends
+that buffer with SMBus block writes. After a failed write the copy is
+dropped, so the next frame redraws every row.
+
+PCF8574 pin mapping (the common backpack wiring):
+- P0 = RS, P1 = RW, P2 = E, P3 = backlight, P4-P7 = D4-D7
+
+Run this file to benchmark a redraw against a fake bus:
+    python3 lcd_transport.py
+"""
+
+import time
+
+# PCF8574 expander bits
+PCF8574_RS = 0x01
+PCF8574_E = 0x04
+PCF8574_BACKLIGHT = 0x08
+
+# HD44780 commands
+LCD_CLEARDISPLAY = 0x01
+LCD_ENTRYMODESET = 0x06     # Increment cursor, no display shift
+LCD_DISPLAYON = 0x0C        # Display on, cursor off, blink off
+LCD_FUNCTIONSET = 0x28      # 4-bit bus, 2 lines, 5x8 dots
+LCD_SETDDRAMADDR = 0x80
+
+ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+# SMBus block writes carry a command byte plus up to 32 data bytes. The
+# PCF8574 has no registers, so all 33 bytes are latched onto the pins in turn.
+BLOCK_SIZE = 33
+
+def encode_byte(value, rs, backlight):
+    """Encode one HD44780 byte as the expander bytes for two nibble strobes"""
+    flags = (PCF8574_RS if rs else 0) | backlight
+    high = (value & 0xF0) | flags
+    low = ((value << 4) & 0xF0) | flags
+    # Data is set up with E low, latched on the falling edge of E, then held
+    return (high, high | PCF8574_E, high, low, low | PCF8574_E, low)
+
+class BatchedLCD:
+    """HD44780 LCD driver that sends whole updates as SMBus block writes"""
+
+    def __init__(self, bus, address=0x27, cols=16, rows=2, backlight_enabled=True):
+        self.bus = bus
+        self.address = address
+        self.cols = cols
+        self.rows = rows
+        self._backlight = PCF8574_BACKLIGHT if backlight_enabled else 0
+        self._cursor = (0, 0)
+        self.transactions = 0
+        self._init_display()
+        self.shadow = [" " * cols for _ in range(rows)]
+
+    def _init_display(self):
+        """Run the 4-bit initialisation sequence (slow, only done once)"""
+        time.sleep(0.05)
+        for delay in (0.0045, 0.0045, 0.00015):
+            self._write_nibble(0x30)
+            time.sleep(delay)
+        self._write_nibble(0x20)
+        for command in (LCD_FUNCTIONSET, LCD_DISPLAYON, LCD_CLEARDISPLAY, LCD_ENTRYMODESET):
+            self._send(self._encode_command(command))
+            if command == LCD_CLEARDISPLAY:
+                time.sleep(0.002)
+
+    def _write_nibble(self, nibble):
+        value = nibble | self._backlight
+        self._send([value, value | PCF8574_E, value])
+
+    def _encode_command(self, command):
+        return encode_byte(command, False, self._backlight)
+
+    def _send(self, data):
+        """Send expander bytes using as few block writes as possible"""
+        for start in range(0, len(data), BLOCK_SIZE):
+            chunk = data[start:start + BLOCK_SIZE]
+            if len(chunk) == 1:
+                self.bus.write_byte(self.address, chunk[0])
+            else:
+                self.bus.write_i2c_block_data(self.address, chunk[0], list(chunk[1:]))
+            self.transactions += 1
+
+    def encode_frame(self, lines):
+        """Encode the changes from the current screen to 'lines' into one buffer"""
+        buffer = []
+        backlight = self._backlight
+        for row in range(self.rows):
+            text = lines[row] if row < len(lines) else ""
+            text = text[:self.cols].ljust(self.cols)
+            old = self.shadow[row]
+            if text == old:
+                continue
+            first, last = 0, self.cols - 1
+            if old is not None:
+                # Only rewrite the span between the first and last changed column
+                while text[first] == old[first]:
+                    first += 1
+                while text[last] == old[last]:
+                    last -= 1
+            buffer.extend(encode_byte(LCD_SETDDRAMADDR | (ROW_OFFSETS[row] + first), False, backlight))
+            for char in text[first:last + 1]:
+                code = ord(char)
+                buffer.extend(encode_byte(code if code < 0x80 else 0x3F, True, backlight))
+            self.shadow[row] = text
+        return buffer
+
+    def write_frame(self, *lines):
+        """Show 'lines' on the display, one string per row"""
+        buffer = self.encode_frame(lines)
+        if buffer:
+            try:
+                self._send(buffer)
+            except OSError:
+                # Part of the frame may have reached the screen: redraw every row next time
+                self.shadow = [None] * self.rows
+                raise
+
+    # RPLCD compatible interface
+    def clear(self):
+        self.write_frame(*([""] * self.rows))
+        self._cursor = (0, 0)
+
+    @property
+    def cursor_pos(self):
+        return self._cursor
+
+    @cursor_pos.setter
+    def cursor_pos(self, pos):
+        self._cursor = pos
+
+    def write_string(self, text):
+        """Write text at the cursor position (no line wrapping)"""
+        row, col = self._cursor
+        lines = [" " * self.cols if line is None else line for line in self.shadow]
+        line = lines[row]
+        text = text[:self.cols - col]
+        lines[row] = line[:col] + text + line[col + len(text):]
+        self.write_frame(*lines)
+        self._cursor = (row, col + len(text))
+
+    @property
+    def backlight_enabled(self):
+        return bool(self._backlight)
+
+    @backlight_enabled.setter
+    def backlight_enabled(self, enabled):
+        self._backlight = PCF8574_BACKLIGHT if enabled else 0
+        self._send([self._backlight])
+
+class FakeBus:
+    """SMBus stand-in that counts transactions and bytes on the wire"""
+
+    def __init__(self):
+        self.transactions = 0
+        self.bytes = 0
+
+    def write_byte(self, address, value):
+        self.transactions += 1
+        self.bytes += 1
+
+    def write_i2c_block_data(self, address, command, data):
+        self.transactions += 1
+        self.bytes += 1 + len(data)
+
+    def bus_time(self, clock_hz=100000):
+        """Estimated time on the wire: address byte + data bytes, 9 bits each"""
+        return (self.transactions + self.bytes) * 9 / clock_hz
+
+def rplcd_redraw_transactions(lines):
+    """Byte writes RPLCD issues for update_lcd(): clear, cursor moves, text"""
+    # RPLCD sends 4 byte writes per nibble, 2 nibbles per HD44780 byte
+    hd44780_bytes = 1  # clear
+    for line in lines:
+        hd44780_bytes += 1 + len(line)  # cursor move + characters
+    return hd44780_bytes * 8
+
+def benchmark(frames=1000):
+    frames_text = [
+        ("Credit: P0.00", "Need P10.00 more"),
+        ("Credit: P5.00", "Need P5.00 more"),
+        ("Credit: P10.00", "B1:Ready B2:Ready"),
+        ("Dispensing...", "Please wait"),
+        ("Item Dispensed", "Thank You!"),
+    ]
+    bus = FakeBus()
+    lcd = BatchedLCD(bus)
+    bus.transactions = bus.bytes = 0
+    start = time.perf_counter()
+    for i in range(frames):
+        lcd.write_frame(*frames_text[i % len(frames_text)])
+    encode_time = time.perf_counter() - start
+
+    legacy = sum(rplcd_redraw_transactions(frames_text[i % len(frames_text)]) for i in range(frames))
+    # RPLCD: 1 address + 1 data byte per write, plus a 100 us pause per nibble
+    legacy_time = legacy * 2 * 9 / 100000 + legacy / 4 * 0.0001
+    print(f"Frames drawn:          {frames}")
+    print(f"RPLCD transactions:    {legacy / frames:.1f} per frame")
+    print(f"Batched transactions:  {bus.transactions / frames:.1f} per frame")
+    print(f"Reduction:             {legacy / max(bus.transactions, 1):.1f}x fewer transactions")
+    print(f"Bus time (100 kHz):    {legacy_time / frames * 1000:.2f} ms -> {bus.bus_time() / frames * 1000:.2f} ms per frame")
+    print(f"Encode time:           {encode_time / frames * 1e6:.1f} us per frame")
+
+if __name__ == "__main__":
+    benchmark()
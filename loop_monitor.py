@@ -0,0 +1,179 @@
+"""
+Main loop health monitor
+The loop calls tick() at the top of every iteration. The monitor keeps a
+histogram of iteration periods, and a watchdog thread checks how long the
+current iteration has been running. When it passes the budget, the
+watchdog samples the loop thread's stack until the iteration ends and
+reports which call the samples were stuck in:
+    coin loop overran: 2013 ms (budget 100 ms) in update_money_collected
+    (coinslot.py:312) -> recv_into (socket.py:706)
+Waits the loop makes on purpose (a debounce, a vend) are wrapped in
+expected_wait() and left out of the timing, up to the limit given.
+"""
+
+import bisect
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import traceback
+
+# Histogram bucket upper bounds: 0.5 ms doubling every 4 buckets, up to ~70 s
+BUCKET_BOUNDS = [0.0005 * 2 ** (i / 4) for i in range(69)]
+
+class LoopMonitor:
+    """Histogram of loop periods plus blocking-call capture on overruns"""
+
+    def __init__(self, name, period, budget=None, log=None, sample_interval=None, project_dir=None):
+        self.name = name
+        self.period = period
+        self.budget = budget or period * 10
+        self.log = log
+        self.sample_interval = sample_interval or max(self.budget / 4, 0.005)
+        self.project_dir = project_dir or os.path.dirname(os.path.abspath(__file__))
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.window = [0] * (len(BUCKET_BOUNDS) + 1)  # Periods since the last take_window()
+        self.window_max = 0.0
+        self.iterations = 0
+        self.max_period = 0.0
+        self.overrun_count = 0
+        self.overruns = collections.deque(maxlen=20)
+        self.samples = collections.Counter()  # culprit -> samples in the current overrun
+        self.thread_id = None
+        self.last_tick = None
+        self.allowance = 0.0  # Seconds of expected waits in the current iteration
+        self.running = False
+
+    # Loop thread
+    def tick(self):
+        """Mark the start of a loop iteration"""
+        now = time.perf_counter()
+        last = self.last_tick
+        self.last_tick = now
+        if last is None:
+            self.thread_id = threading.get_ident()
+            return
+        elapsed = now - last - self.allowance
+        self.allowance = 0.0
+        bucket = bisect.bisect_left(BUCKET_BOUNDS, elapsed)
+        self.counts[bucket] += 1
+        self.window[bucket] += 1
+        self.iterations += 1
+        if elapsed > self.max_period:
+            self.max_period = elapsed
+        if elapsed > self.window_max:
+            self.window_max = elapsed
+        if elapsed > self.budget:
+            self._record_overrun(elapsed)
+
+    @contextlib.contextmanager
+    def expected_wait(self, limit):
+        """Leave a wait of up to 'limit' seconds out of the current iteration
+
+        The iteration's budget grows by 'limit' while inside, so healthy()
+        stays true, and the time spent is not counted in its period. Time
+        past 'limit' still counts and is reported as an overrun.
+        """
+        start = time.perf_counter()
+        self.allowance += limit
+        try:
+            yield
+        finally:
+            self.allowance -= limit - min(time.perf_counter() - start, limit)
+
+    def _record_overrun(self, elapsed):
+        self.overrun_count += 1
+        samples, self.samples = self.samples, collections.Counter()
+        culprit = samples.most_common(1)[0][0] if samples else "unknown (not sampled)"
+        self.overruns.append({
+            "at": time.time(),
+            "duration_ms": round(elapsed * 1000, 1),
+            "culprit": culprit,
+            "samples": sum(samples.values()),
+        })
+        message = "%s overran: %d ms (budget %d ms) in %s"
+        args = (self.name, elapsed * 1000, self.budget * 1000, culprit)
+        if self.log:
+            self.log.warning(message, *args)
+        else:
+            print(message % args)
+
+    # Watchdog thread
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self._watchdog, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def _watchdog(self):
+        while self.running:
+            time.sleep(self.sample_interval)
+            last = self.last_tick
+            if last is None or time.perf_counter() - last <= self.budget + self.allowance:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[self.describe(traceback.extract_stack(frame))] += 1
+
+    def describe(self, stack):
+        """Name the innermost project call and the call it is blocked in"""
+        project = [f for f in stack if f.filename.startswith(self.project_dir)]
+        leaf = stack[-1]
+        where = f"{leaf.name} ({os.path.basename(leaf.filename)}:{leaf.lineno})"
+        if project and project[-1] is not leaf:
+            owner = project[-1]
+            return f"{owner.name} ({os.path.basename(owner.filename)}:{owner.lineno}) -> {where}"
+        return where
+
+    def healthy(self):
+        """True once the loop is running and the current iteration is within budget"""
+        last = self.last_tick
+        return last is not None and time.perf_counter() - last <= self.budget + self.allowance
+
+    # Reporting
+    def percentile(self, fraction, counts=None, max_period=None):
+        """Approximate period percentile (upper bound of its bucket, seconds)"""
+        counts = self.counts if counts is None else counts
+        max_period = self.max_period if max_period is None else max_period
+        total = sum(counts)
+        if not total:
+            return 0.0
+        target = fraction * total
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return min(BUCKET_BOUNDS[i], max_period) if i < len(BUCKET_BOUNDS) else max_period
+        return max_period
+
+    def take_window(self):
+        """Period percentiles (ms) since the previous call, then start a new window"""
+        window, self.window = self.window, [0] * (len(BUCKET_BOUNDS) + 1)
+        window_max, self.window_max = self.window_max, 0.0
+        return {
+            "iterations": sum(window),
+            "p50_ms": self.percentile(0.5, window, window_max) * 1000,
+            "p99_ms": self.percentile(0.99, window, window_max) * 1000,
+            "max_ms": window_max * 1000,
+        }
+
+    def stats(self):
+        last = self.last_tick
+        return {
+            "name": self.name,
+            "period_ms": self.period * 1000,
+            "budget_ms": self.budget * 1000,
+            "iterations": self.iterations,
+            "p50_ms": round(self.percentile(0.5) * 1000, 2),
+            "p90_ms": round(self.percentile(0.9) * 1000, 2),
+            "p99_ms": round(self.percentile(0.99) * 1000, 2),
+            "max_ms": round(self.max_period * 1000, 2),
+            "current_ms": round((time.perf_counter() - last) * 1000, 2) if last else None,
+            "overruns": self.overrun_count,
+            "recent_overruns": list(self.overruns),
+        }
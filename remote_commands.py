@@ -0,0 +1,194 @@
+"""
+Remote command queue for one machine
+Commands are pushed (POST) by the dashboard to
+    /commands/<machine_id>/queue/<push id>  {"type": "restock", "args": {...}}
+and are delivered over a Firebase event stream, so they arrive within
+moments and an idle queue costs no requests beyond the open stream.
+Each command is executed once, in push ID (creation) order, then
+acknowledged at
+    /commands/<machine_id>/acks/<push id>   {"status": "done", "result": ...}
+and removed from the queue. A command stays queued until its ack is
+written (a failed ack is retried on the next event, keep-alive or
+reconnect, without running the command again), and a command whose ack
+already exists (for example after a restart between the ack and the
+delete) is not run again. A command is only run once Firebase has
+answered that it has no ack; while that cannot be checked the command
+and the ones after it wait in the queue.
+"""
+
+import collections
+import json
+import random
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+STREAM_TIMEOUT = (10, 90)   # Connect / read timeout; Firebase sends keep-alives every 30 s
+MAX_BACKOFF = 30            # Longest wait between reconnects (seconds)
+REMEMBERED_COMMANDS = 1000  # Executed command IDs kept to skip duplicates (with their ack until it is written)
+
+class CommandListener:
+    """Listen for queued commands and run them with the matching handler"""
+
+    def __init__(self, base_url, machine_id, handlers, log):
+        self.base_url = base_url.rstrip("/")
+        self.machine_id = machine_id
+        self.handlers = handlers  # command type -> function(args) returning a result
+        self.log = log
+        self.queue = {}
+        self.executed = collections.OrderedDict()
+        self.running = False
+        self.thread = None
+
+    def node_url(self, *parts):
+        return "/".join([self.base_url, "commands", self.machine_id] + list(parts)) + ".json"
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._listen_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    # Event stream
+    def _listen_loop(self):
+        backoff = 1
+        while self.running:
+            try:
+                with requests.get(self.node_url("queue"), stream=True, timeout=STREAM_TIMEOUT,
+                                  headers={"Accept": "text/event-stream"}) as response:
+                    if response.status_code != 200:
+                        raise IOError(f"Status code: {response.status_code}")
+                    self.log.info("Listening for remote commands for machine %s", self.machine_id)
+                    backoff = 1
+                    self._read_events(response)
+            except Exception as e:
+                self.log.warning("Remote command stream error: %s", e)
+            if self.running:
+                time.sleep(backoff + random.uniform(0, backoff / 2))
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _read_events(self, response):
+        event, data = None, None
+        # chunk_size=1 so each event is handled as soon as its last line arrives
+        for line in response.iter_lines(chunk_size=1, decode_unicode=True):
+            if not self.running:
+                return
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = line[len("data:"):].strip()
+            elif not line and event:
+                if event in ("cancel", "auth_revoked"):
+                    raise IOError(f"Stream closed by server ({event})")
+                if event in ("put", "patch"):
+                    self._apply_event(event, json.loads(data))
+                    self._run_pending()
+                elif event == "keep-alive" and self.queue:
+                    # Retry acks that could not be written and commands whose ack could not be checked
+                    self._run_pending()
+                event, data = None, None
+
+    def _apply_event(self, event, message):
+        """Mirror a put/patch event into the local copy of the queue"""
+        parts = [p for p in message["path"].split("/") if p]
+        data = message["data"]
+        if not parts:
+            if event == "put":
+                self.queue = dict(data or {})
+            else:
+                for key, value in (data or {}).items():
+                    self._set(key.split("/"), value)
+        else:
+            if event == "put":
+                self._set(parts, data)
+            else:
+                for key, value in (data or {}).items():
+                    self._set(parts + key.split("/"), value)
+
+    def _set(self, parts, value):
+        command_id = parts[0]
+        if len(parts) == 1:
+            if value is None:
+                self.queue.pop(command_id, None)
+            else:
+                self.queue[command_id] = value
+            return
+        record = self.queue.setdefault(command_id, {})
+        if isinstance(record, dict):
+            if value is None:
+                record.pop(parts[1], None)
+            else:
+                record[parts[1]] = value
+
+    # Execution
+    def _run_pending(self):
+        for command_id in sorted(self.queue):
+            record = self.queue.get(command_id)
+            if command_id not in self.executed:
+                acked = self._already_acked(command_id)
+                if acked is None:
+                    # It may have run before a restart: checked again on the next event, keep-alive
+                    # or reconnect, and later commands wait so they still run in order
+                    break
+                if not acked:
+                    status, result = self._execute(record)
+                    self.executed[command_id] = {
+                        "status": status,
+                        "result": result,
+                        "executed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                    while len(self.executed) > REMEMBERED_COMMANDS:
+                        self.executed.popitem(last=False)
+            ack = self.executed.get(command_id)
+            if ack:
+                if not self._acknowledge(command_id, ack):
+                    # Keep it queued so the dashboard still gets its confirmation
+                    continue
+                self.executed[command_id] = None
+            # Remove it from the queue; the stream will echo the delete back
+            self.queue.pop(command_id, None)
+            try:
+                requests.delete(self.node_url("queue", command_id), timeout=10)
+            except Exception as e:
+                self.log.warning("Failed to remove command %s from queue: %s", command_id, e)
+
+    def _already_acked(self, command_id):
+        """True or False once Firebase has answered, None if it could not be asked"""
+        try:
+            response = requests.get(self.node_url("acks", command_id), timeout=10)
+            if response.status_code == 200:
+                return response.json() is not None
+            self.log.warning("Failed to check command %s: status code %s", command_id, response.status_code)
+        except Exception as e:
+            self.log.warning("Failed to check command %s: %s", command_id, e)
+        return None
+
+    def _execute(self, record):
+        if not isinstance(record, dict) or "type" not in record:
+            return "invalid", None
+        handler = self.handlers.get(record["type"])
+        if handler is None:
+            self.log.warning("Unsupported remote command: %s", record["type"])
+            return "unsupported", None
+        self.log.info("Remote command received: %s %s", record["type"], record.get("args", {}))
+        try:
+            return "done", handler(record.get("args") or {})
+        except Exception as e:
+            self.log.error("Remote command %s failed: %s", record["type"], e)
+            return "failed", str(e)
+
+    def _acknowledge(self, command_id, ack):
+        """Write the ack; True once Firebase has it"""
+        try:
+            response = requests.put(self.node_url("acks", command_id), data=json.dumps(ack), timeout=10)
+            if response.status_code == 200:
+                return True
+            self.log.warning("Failed to acknowledge command %s: status code %s", command_id, response.status_code)
+        except Exception as e:
+            self.log.warning("Failed to acknowledge command %s: %s", command_id, e)
+        return False
@@ -0,0 +1,167 @@
+"""
+Asynchronous logging that stays off the hot path
+Log calls only append a fixed-format record (time, level, format string,
+arguments) to an in-memory ring. A background writer formats the records
+and writes them to stdout in batches:
+- Records below the configured level are dropped before they are stored
+- Each format string may log at most 'rate_limit' records per second;
+  the rest are counted and reported as one summary line
+- When the ring is full the oldest records are overwritten and counted
+Under systemd each line gets a '<N>' syslog priority prefix so journald
+keeps the level.
+"""
+
+import atexit
+import collections
+import json
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+SYSLOG_PRIORITIES = {DEBUG: 7, INFO: 6, WARNING: 4, ERROR: 3}
+
+class RingLogger:
+    """Logger that defers formatting and output to a background thread"""
+
+    def __init__(self, name, level=INFO, capacity=4096, flush_interval=0.25,
+                 rate_limit=20, stream=None, syslog_prefix=False, json_output=False):
+        self.name = name
+        unknown_level = None
+        if isinstance(level, str):
+            # Names are case-insensitive (VENDO_LOG_LEVEL=info); anything else logs at INFO
+            unknown_level = level if level.upper() not in LEVELS else None
+            level = LEVELS.get(level.upper(), INFO)
+        self.level = level
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.rate_limit = rate_limit
+        self.stream = stream or sys.stdout
+        self.syslog_prefix = syslog_prefix
+        self.json_output = json_output
+        self.ring = collections.deque(maxlen=capacity)
+        self.dropped = 0
+        self.dropped_total = 0   # Dropped records reported so far
+        self.suppressed = {}     # format string -> records skipped by the rate limit
+        self.window_start = time.time()
+        self.window_counts = {}  # format string -> records logged this second
+        self.wakeup = threading.Event()
+        self.write_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        if unknown_level is not None:
+            self.warning("Unknown log level %r - logging at INFO", unknown_level)
+
+    # Hot path
+    def log(self, level, fmt, *args):
+        if level < self.level:
+            return
+        now = time.time()
+        if now - self.window_start >= 1.0:
+            self.window_start = now
+            self.window_counts = {}
+        count = self.window_counts.get(fmt, 0) + 1
+        self.window_counts[fmt] = count
+        if count > self.rate_limit:
+            self.suppressed[fmt] = self.suppressed.get(fmt, 0) + 1
+            return
+        ring = self.ring
+        if len(ring) >= self.capacity:
+            self.dropped += 1
+        ring.append((now, level, fmt, args))
+        if len(ring) > self.capacity // 2:
+            self.wakeup.set()
+
+    def debug(self, fmt, *args):
+        if DEBUG >= self.level:
+            self.log(DEBUG, fmt, *args)
+
+    def info(self, fmt, *args):
+        if INFO >= self.level:
+            self.log(INFO, fmt, *args)
+
+    def warning(self, fmt, *args):
+        if WARNING >= self.level:
+            self.log(WARNING, fmt, *args)
+
+    def error(self, fmt, *args):
+        if ERROR >= self.level:
+            self.log(ERROR, fmt, *args)
+
+    # Writer
+    def start(self):
+        """Start the background writer and flush on interpreter exit"""
+        if self.running:
+            return self
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    def close(self):
+        """Stop the writer and flush everything still in the ring"""
+        self.running = False
+        self.wakeup.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.flush()
+
+    def _writer_loop(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Format and write all pending records in one batch"""
+        with self.write_lock:
+            lines = []
+            ring = self.ring
+            while ring:
+                try:
+                    lines.append(self.format(*ring.popleft()))
+                except IndexError:
+                    break
+            if self.suppressed:
+                suppressed, self.suppressed = self.suppressed, {}
+                for fmt, count in suppressed.items():
+                    lines.append(self.format(time.time(), WARNING,
+                                             "Suppressed %d repeated messages: %r", (count, fmt)))
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                self.dropped_total += dropped
+                lines.append(self.format(time.time(), WARNING,
+                                         "Dropped %d log records (ring full)", (dropped,)))
+            if not lines:
+                return
+            try:
+                self.stream.write("".join(lines))
+                self.stream.flush()
+            except (OSError, ValueError):
+                pass
+
+    def format(self, timestamp, level, fmt, args):
+        try:
+            message = fmt % args if args else fmt
+        except (TypeError, ValueError):
+            message = f"{fmt} {args!r}"
+        if self.json_output:
+            line = json.dumps({
+                "ts": round(timestamp, 3),
+                "level": LEVEL_NAMES.get(level, str(level)),
+                "logger": self.name,
+                "msg": message,
+            }, ensure_ascii=False)
+        else:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+            line = f"{stamp}.{int(timestamp * 1000) % 1000:03d} {LEVEL_NAMES.get(level, level):<7} {self.name}: {message}"
+        if self.syslog_prefix:
+            line = f"<{SYSLOG_PRIORITIES.get(level, 6)}>{line}"
+        return line + "\n"
@@ -0,0 +1,165 @@
+"""
+Fixed-size on-device time-series store
+Each metric is one preallocated, memory-mapped file holding ring archives
+at several resolutions (round-robin database style). Every sample is
+folded into the current slot of each archive (count, sum, min, max), so
+coarser archives are downsampled in place as data arrives:
+- Storage never grows: slots are reused once an archive wraps around
+- A write touches one slot per archive, whatever the history length
+- Queries read only the slots in the requested range
+"""
+
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+MAGIC = b"RRD1"
+
+# (seconds per slot, number of slots)
+DEFAULT_ARCHIVES = (
+    (1, 3600),      # 1 hour at 1 second
+    (60, 10080),    # 7 days at 1 minute
+    (3600, 2160),   # 90 days at 1 hour
+)
+
+HEADER_FORMAT = "<4sI"           # magic, number of archives
+ARCHIVE_FORMAT = "<II"           # resolution, slots
+SLOT_FORMAT = "<qdddd"           # bucket number, count, sum, min, max
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT)
+EMPTY_BUCKET = -1
+
+METRIC_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+class RRDFile:
+    """One metric: a memory-mapped file of ring archives"""
+
+    def __init__(self, path, archives):
+        self.archives = tuple(archives)
+        header = struct.pack(HEADER_FORMAT, MAGIC, len(self.archives)) + b"".join(
+            struct.pack(ARCHIVE_FORMAT, res, slots) for res, slots in self.archives)
+        self.offsets = []
+        offset = len(header)
+        for res, slots in self.archives:
+            self.offsets.append(offset)
+            offset += slots * SLOT_SIZE
+        size = offset
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fresh = os.fstat(fd).st_size != size or os.pread(fd, len(header), 0) != header
+            if fresh:
+                # New file, or one written with a different layout: start empty
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if fresh:
+            self.mm[:len(header)] = header
+            empty = struct.pack(SLOT_FORMAT, EMPTY_BUCKET, 0, 0, 0, 0)
+            for (res, slots), start in zip(self.archives, self.offsets):
+                self.mm[start:start + slots * SLOT_SIZE] = empty * slots
+
+    def record(self, value, timestamp):
+        mm = self.mm
+        for (res, slots), start in zip(self.archives, self.offsets):
+            bucket = int(timestamp // res)
+            pos = start + (bucket % slots) * SLOT_SIZE
+            stored, count, total, low, high = struct.unpack_from(SLOT_FORMAT, mm, pos)
+            if stored != bucket:
+                # Slot holds an older period (or nothing): reuse it
+                struct.pack_into(SLOT_FORMAT, mm, pos, bucket, 1, value, value, value)
+            else:
+                struct.pack_into(SLOT_FORMAT, mm, pos, bucket, count + 1, total + value,
+                                 min(low, value), max(high, value))
+
+    def fetch(self, start, end, resolution=None):
+        """Return (resolution, [(time, count, sum, min, max), ...]) for [start, end]"""
+        index = self._pick_archive(start, end, resolution)
+        res, slots = self.archives[index]
+        offset = self.offsets[index]
+        first = max(int(start // res), int(end // res) - slots + 1)
+        points = []
+        for bucket in range(first, int(end // res) + 1):
+            pos = offset + (bucket % slots) * SLOT_SIZE
+            stored, count, total, low, high = struct.unpack_from(SLOT_FORMAT, self.mm, pos)
+            if stored == bucket:
+                points.append((bucket * res, count, total, low, high))
+        return res, points
+
+    def _pick_archive(self, start, end, resolution):
+        if resolution is not None:
+            for i, (res, slots) in enumerate(self.archives):
+                if res >= resolution:
+                    return i
+            return len(self.archives) - 1
+        # Finest archive that still reaches back to 'start'
+        for i, (res, slots) in enumerate(self.archives):
+            if end - res * slots <= start:
+                return i
+        return len(self.archives) - 1
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
+
+class MetricStore:
+    """A directory of RRD files, one per metric, created on first use"""
+
+    def __init__(self, directory, archives=DEFAULT_ARCHIVES):
+        self.directory = directory
+        self.archives = archives
+        self.files = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _file(self, name):
+        rrd = self.files.get(name)
+        if rrd is None:
+            if not METRIC_NAME.match(name):
+                raise ValueError(f"Invalid metric name: {name!r}")
+            rrd = self.files[name] = RRDFile(os.path.join(self.directory, name + ".rrd"), self.archives)
+        return rrd
+
+    def record(self, name, value=1, timestamp=None):
+        """Add one sample (counters record 1 per event)"""
+        with self.lock:
+            self._file(name).record(float(value), time.time() if timestamp is None else timestamp)
+
+    def fetch(self, name, start, end=None, resolution=None):
+        """Samples of 'name' between 'start' and 'end' (unix times, or negative seconds ago)"""
+        now = time.time()
+        end = now if end is None else end
+        if start < 0:
+            start = now + start
+        if end < 0:
+            end = now + end
+        with self.lock:
+            if name not in self.files and not os.path.exists(os.path.join(self.directory, name + ".rrd")):
+                return {"name": name, "resolution": None, "points": []}
+            res, points = self._file(name).fetch(start, end, resolution)
+        return {
+            "name": name,
+            "resolution": res,
+            "points": [{"t": t, "count": c, "sum": s, "min": lo, "max": hi} for t, c, s, lo, hi in points],
+        }
+
+    def names(self):
+        return sorted(f[:-len(".rrd")] for f in os.listdir(self.directory) if f.endswith(".rrd"))
+
+    def flush(self):
+        with self.lock:
+            for rrd in self.files.values():
+                rrd.flush()
+
+    def close(self):
+        with self.lock:
+            for rrd in self.files.values():
+                rrd.flush()
+                rrd.close()
+            self.files = {}
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+systemd readiness and watchdog notifications
+Implements the sd_notify protocol (one datagram per message to the Unix
+socket in $NOTIFY_SOCKET) without extra packages. Outside systemd
+$NOTIFY_SOCKET is unset and every call is a no-op.
+
+With Type=notify and WatchdogSec= in the unit file:
+- READY=1 tells systemd the service finished starting
+- WATCHDOG=1 must arrive at least every WatchdogSec or systemd restarts
+  the service; start_watchdog() only sends it while a health check passes
+
+Run this file with a command to watch its notifications through a fake
+notify socket:
+    python3 sdnotify.py python3 coinslot.py
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_socket = None
+_socket_lock = threading.Lock()
+
+def notify(message):
+    """Send a notification; returns False when not running under systemd"""
+    global _socket
+    path = os.environ.get("NOTIFY_SOCKET")
+    if not path:
+        return False
+    if path.startswith("@"):
+        path = "\0" + path[1:]  # Abstract namespace socket
+    try:
+        with _socket_lock:
+            if _socket is None:
+                _socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+            _socket.sendto(message.encode("utf-8"), path)
+        return True
+    except OSError:
+        return False
+
+def watchdog_interval():
+    """Seconds between watchdog pings (half of WatchdogSec), or None if disabled"""
+    usec = os.environ.get("WATCHDOG_USEC")
+    pid = os.environ.get("WATCHDOG_PID")
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1e6 / 2
+
+def start_watchdog(is_healthy, log=None):
+    """Ping the systemd watchdog from a thread for as long as is_healthy() is true
+
+    Health is checked every second (or more often for short watchdog
+    timeouts) so a ping goes out soon after a slow iteration recovers,
+    while a stalled loop stops the pings and lets systemd restart us.
+    """
+    interval = watchdog_interval()
+    if interval is None:
+        return None
+
+    def pinger():
+        last_ping = 0.0
+        unhealthy_since = None
+        while True:
+            time.sleep(min(interval / 4, 1.0))
+            now = time.monotonic()
+            if not is_healthy():
+                if unhealthy_since is None:
+                    unhealthy_since = now
+                    if log:
+                        log.warning("Main loop stalled - holding back watchdog pings")
+                continue
+            if unhealthy_since is not None:
+                if log:
+                    log.info("Main loop recovered after %.1f s", now - unhealthy_since)
+                unhealthy_since = None
+            if now - last_ping >= interval:
+                notify("WATCHDOG=1")
+                last_ping = now
+
+    thread = threading.Thread(target=pinger, daemon=True)
+    thread.start()
+    return thread
+
+def run_with_fake_socket(command, watchdog_sec=10):
+    """Run 'command' with a fake NOTIFY_SOCKET and print what it sends"""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "notify")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(path)
+    env = dict(os.environ, NOTIFY_SOCKET=path, WATCHDOG_USEC=str(int(watchdog_sec * 1e6)))
+    process = subprocess.Popen(command, env=env)
+    start = time.monotonic()
+    server.settimeout(0.5)
+    last_watchdog = start
+    try:
+        while process.poll() is None:
+            try:
+                message = server.recv(4096).decode("utf-8")
+            except socket.timeout:
+                if time.monotonic() - last_watchdog > watchdog_sec:
+                    print(f"[{time.monotonic() - start:8.3f}] watchdog expired - systemd would restart the service")
+                    last_watchdog = time.monotonic()
+                continue
+            if "WATCHDOG=1" in message:
+                last_watchdog = time.monotonic()
+            print(f"[{time.monotonic() - start:8.3f}] {message.strip()}")
+    except KeyboardInterrupt:
+        process.terminate()
+    finally:
+        server.close()
+        os.unlink(path)
+        os.rmdir(directory)
+    return process.wait()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: sdnotify.py COMMAND [ARG ...]")
+        sys.exit(1)
+    sys.exit(run_with_fake_socket(sys.argv[1:]))
@@ -0,0 +1,869 @@
+#!/usr/bin/env python3
+"""
+End-to-end soak test for coinslot.py and vendo.py
+Runs the real script, main() and all its threads, against simulated
+surroundings:
+- FakeGPIO: pin levels come from a seeded schedule of customers (coin
+  pulse trains, button presses, keypresses or socket commands) and a
+  dispenser model that breaks the IR beam some time after a motor relay
+  switches on, occasionally jams, and slowly wears on channel 2
+- lcd_transport.FakeBus in place of the I2C bus
+- VirtualClock in place of the script's time module
+- firebase_emulator.py in place of Firebase (coinslot.py), optionally
+  with injected latency, server errors, lost replies (the write commits,
+  the response never arrives) and a network partition for a few minutes
+  of every hour, so the retry and offline sync paths are exercised too
+
+The thread running main() drives the clock: its sleeps advance simulated
+time at once, stopping at every other thread's wake-up time and every
+scheduled coin edge on the way, and any other thread's sleep waits until
+the clock reaches its wake-up time. After each step the driver gives the threads that
+came due a few milliseconds to run before moving on, so short code
+paths (polling an IR sensor) run in step with the loop while slow ones
+(HTTP requests) overlap it as they would on the device. Hours of
+machine time run in a minute or two.
+
+Both scripts open their hardware and files in setup() / initialize()
+rather than at import, so they are imported here with the fakes in
+place.
+
+Checked throughout and at the end:
+- credit and inventory never go negative
+- no lost pulses: every coin inserted is credited with its value
+- money is conserved: inserted = credit left + price x vends charged
+- Firebase agrees: money collected, transactions and inventory
+- every motor run ends within its timeout
+
+    python3 soak.py coinslot --hours 4 --seed 1
+    python3 soak.py coinslot --latency 0.3 --error-rate 0.05 --lost-reply-rate 0.02 --partition 5
+    python3 soak.py vendo --hours 4
+"""
+
+import abc
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import requests
+
+from firebase_emulator import FirebaseEmulator
+from lcd_transport import FakeBus
+
+LOW = 0
+HIGH = 1
+
+# Customer behaviour (simulated seconds)
+PULSE_LOW = 0.03       # Coin acceptor pulse width
+PULSE_PERIOD = 0.1     # Pulse spacing within one coin
+COIN_GAP = 1.5         # Between coins (longer than both scripts' COIN_TIMEOUT)
+PRESS_TIME = 0.1       # How long a button is held
+CUSTOMER_GAP = 12.0    # Mean time between customers
+
+# Dispenser model
+DISPENSE_TIME = (1.0, 1.2)   # Mean motor-on to IR time per channel
+DISPENSE_SPREAD = 0.08       # Relative standard deviation
+WEAR = (0.0, 0.5)            # Extra dispense time per channel by the end of the run (fraction)
+JAM_RATE = 0.005             # Vends where the item never reaches the IR sensor
+IR_WIDTH = 0.08              # How long a falling item blocks the beam
+
+STEP_WAIT = 0.005      # Real seconds the driver waits for threads that came due
+DRAIN_TIME = 1800      # Simulated seconds after the run for Firebase retries to catch up
+
+_real_monotonic = time.monotonic
+
+class VirtualClock:
+    """Simulated time for the script's time module (time, monotonic, sleep)"""
+
+    def __init__(self, start=1_700_000_000.0, step_wait=STEP_WAIT):
+        self.origin = start
+        self.now = start
+        self.step_wait = step_wait
+        self.cond = threading.Condition()
+        self.sleepers = {}   # thread id -> wake-up time
+        self.pending = set()  # woken threads the driver is waiting for
+        self.driver = None
+        self.stopped = False
+        self.hooks = []  # Called by the driver with (previous, now) after every step
+        self.event_sources = []  # Return the time of their next scheduled event (or None)
+        self.steps = 0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now - self.origin
+
+    def sleep(self, seconds):
+        ident = threading.get_ident()
+        if ident == self.driver:
+            self.advance(seconds)
+            return
+        with self.cond:
+            self.pending.discard(ident)
+            wake = self.now + seconds
+            self.sleepers[ident] = wake
+            self.cond.notify_all()
+            while self.now < wake and not self.stopped:
+                self.cond.wait(1.0)
+            del self.sleepers[ident]
+
+    def advance(self, seconds):
+        """Move time forward, stopping at every sleeper's wake-up and scheduled event on the way"""
+        target = self.now + max(seconds, 0)
+        while True:
+            with self.cond:
+                wakes = [wake for wake in self.sleepers.values() if wake > self.now]
+            events = [when for when in (source() for source in self.event_sources) if when is not None and when > self.now]
+            stop = min([target] + wakes + events)
+            self._step(stop)
+            if stop >= target or self.stopped:
+                return
+
+    def _step(self, until):
+        with self.cond:
+            previous = self.now
+            self.now = until
+            self.steps += 1
+            self.pending.update(ident for ident, wake in self.sleepers.items() if wake <= self.now)
+            self.cond.notify_all()
+            deadline = _real_monotonic() + self.step_wait
+            while self.pending and not self.stopped:
+                remaining = deadline - _real_monotonic()
+                if remaining <= 0:
+                    # Busy in I/O: let it run alongside the loop
+                    self.pending.clear()
+                    break
+                self.cond.wait(remaining)
+        for hook in self.hooks:
+            hook(previous, self.now)
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def __getattr__(self, name):
+        # Anything else (strftime, perf_counter, ...) comes from the real time module
+        return getattr(time, name)
+
+class Signal:
+    """LOW intervals of one input pin, read in time order"""
+
+    def __init__(self):
+        self.intervals = collections.deque()  # (start, end), sorted
+        self.lock = threading.Lock()
+
+    def add(self, start, end):
+        with self.lock:
+            self.intervals.append((start, end))
+
+    def cut(self, at):
+        """Drop intervals that have not started by 'at' (an item that never fell)"""
+        with self.lock:
+            self.intervals = collections.deque((s, e) for s, e in self.intervals if s < at)
+
+    def level(self, now):
+        with self.lock:
+            intervals = self.intervals
+            while intervals and intervals[0][1] <= now:
+                intervals.popleft()
+            return LOW if intervals and intervals[0][0] <= now else HIGH
+
+    def busy(self, now):
+        with self.lock:
+            return any(end > now for start, end in self.intervals)
+
+class World:
+    """Customers and dispensers around the machine"""
+
+    def __init__(self, clock, rng, pins, coin_values, price, end_time, coin_timeout):
+        self.clock = clock
+        self.rng = rng
+        self.pins = pins  # coin, buttons (2), relays (2), irs (2)
+        self.coins = sorted(set(coin_values.values()))
+        self.pulses = {}
+        for pulses, value in sorted(coin_values.items()):
+            # Pulse count the acceptor sends for each coin (closest to its value)
+            best = self.pulses.get(value)
+            if best is None or abs(pulses - value) < abs(best - value):
+                self.pulses[value] = pulses
+        self.price = price
+        self.end_time = end_time
+        self.coin_gap = max(COIN_GAP, coin_timeout * 1.5)
+        self.start_time = clock.now
+        self.signals = collections.defaultdict(Signal)
+        self.coin_edges = collections.deque()  # Falling edge times for interrupt-driven scripts
+        self.lock = threading.Lock()
+        self.next_customer = clock.now + 5.0  # Let the script start up
+        self.customer_busy_until = 0.0
+        self.purchases = collections.deque()  # (time, channel, method) not yet handed out
+        self.keys = collections.deque()       # (time, key) for a fake keyboard
+        self.socket_commands = collections.deque()  # (time, command) for a fake console
+        # Tallies
+        self.inserted = collections.Counter()  # coin value -> count
+        self.presses = 0
+        self.relay_on = [None, None]
+        self.motor_runs = [0, 0]
+        self.delivered = [0, 0]
+        self.jams = [0, 0]
+        self.item_due = [None, None]
+        self.run_times = []
+        self.longest_run = 0.0
+        self.purchase_methods = ("button",)
+
+    # Inputs
+    def level(self, pin):
+        return self.signals[pin].level(self.clock.now)
+
+    def on_output(self, pin, value):
+        now = self.clock.now
+        for channel, relay in enumerate(self.pins["relays"]):
+            if pin != relay:
+                continue
+            if value == LOW and self.relay_on[channel] is None:
+                self.relay_on[channel] = now
+                self.motor_runs[channel] += 1
+                progress = (now - self.start_time) / max(self.end_time - self.start_time, 1)
+                mean = DISPENSE_TIME[channel] * (1 + WEAR[channel] * progress)
+                if self.rng.random() < JAM_RATE:
+                    self.jams[channel] += 1
+                    self.item_due[channel] = None
+                else:
+                    due = now + max(self.rng.gauss(mean, mean * DISPENSE_SPREAD), 0.05)
+                    self.item_due[channel] = due
+                    self.signals[self.pins["irs"][channel]].add(due, due + IR_WIDTH)
+            elif value == HIGH and self.relay_on[channel] is not None:
+                run_time = now - self.relay_on[channel]
+                self.run_times.append(run_time)
+                self.longest_run = max(self.longest_run, run_time)
+                due = self.item_due[channel]
+                if due is not None and due <= now:
+                    self.delivered[channel] += 1
+                else:
+                    # Motor stopped before the item fell: it stays in the spiral
+                    self.signals[self.pins["irs"][channel]].cut(now)
+                self.relay_on[channel] = None
+                self.item_due[channel] = None
+
+    # Customers
+    def step(self, previous, now):
+        if now >= self.next_customer and now < self.end_time:
+            self._schedule_customer(max(now, self.customer_busy_until))
+        while self.purchases and self.purchases[0][0] <= now:
+            at, channel, method = self.purchases.popleft()
+            self._purchase(at, channel, method)
+
+    def _schedule_customer(self, start):
+        rng = self.rng
+        # Coins until the price is covered, now and then a few short or extra
+        target = self.price + rng.choice((0, 0, 0, 0, -1, 1, 5)) * min(self.coins)
+        t = start
+        total = 0
+        while total < target:
+            value = rng.choice(self.coins)
+            pulses = self.pulses[value]
+            for i in range(pulses):
+                pulse_start = t + i * PULSE_PERIOD
+                self.signals[self.pins["coin"]].add(pulse_start, pulse_start + PULSE_LOW)
+                self.coin_edges.append(pulse_start)
+            self.inserted[value] += 1
+            total += value
+            t += pulses * PULSE_PERIOD + self.coin_gap
+        channel = rng.randrange(2)
+        method = rng.choice(self.purchase_methods)
+        self.purchases.append((t, channel, method))
+        self.customer_busy_until = t + 3.0
+        self.next_customer = self.customer_busy_until + rng.expovariate(1 / CUSTOMER_GAP)
+
+    def _purchase(self, at, channel, method):
+        self.presses += 1
+        if method == "button":
+            self.signals[self.pins["buttons"][channel]].add(at, at + PRESS_TIME)
+        elif method == "key":
+            self.keys.append((at, str(channel + 1)))
+        else:
+            self.socket_commands.append((at, f"nap-{channel + 1}"))
+
+    def idle(self, now):
+        """No customer, coin or vend still in progress"""
+        return (now >= self.customer_busy_until and not self.purchases
+                and not self.signals[self.pins["coin"]].busy(now)
+                and self.relay_on == [None, None])
+
+class FakeGPIO:
+    """RPi.GPIO stand-in backed by the World"""
+
+    BCM = "BCM"
+    BOARD = "BOARD"
+    IN = "IN"
+    OUT = "OUT"
+    PUD_UP = "PUD_UP"
+    PUD_DOWN = "PUD_DOWN"
+    HIGH = HIGH
+    LOW = LOW
+    FALLING = "FALLING"
+    RISING = "RISING"
+    BOTH = "BOTH"
+
+    def __init__(self, world=None):
+        self.world = world
+        self.outputs = {}
+        self.callbacks = {}
+        self.reads = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        pass
+
+    def cleanup(self, pin=None):
+        pass
+
+    def output(self, pin, value):
+        previous = self.outputs.get(pin)
+        self.outputs[pin] = value
+        if previous != value and self.world:
+            self.world.on_output(pin, value)
+
+    def input(self, pin):
+        self.reads += 1
+        return self.world.level(pin) if self.world else HIGH
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+class EdgeDispatcher:
+    """Deliver falling edges to GPIO callbacks from their own thread, like RPi.GPIO"""
+
+    def __init__(self, gpio, world, pin):
+        self.gpio = gpio
+        self.world = world
+        self.pin = pin
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+        self.done = threading.Event()
+        self.running = True
+        self.delivered = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def step(self, previous, now):
+        edges = self.world.coin_edges
+        batch = 0
+        while edges and edges[0] <= now:
+            edges.popleft()
+            batch += 1
+        if batch:
+            self.done.clear()
+            self.queue.append(batch)
+            self.wakeup.set()
+            self.done.wait(0.05)
+
+    def _run(self):
+        while self.running:
+            self.wakeup.wait(0.1)
+            self.wakeup.clear()
+            while self.queue:
+                for _ in range(self.queue.popleft()):
+                    callback = self.gpio.callbacks.get(self.pin)
+                    if callback:
+                        callback(self.pin)
+                        self.delivered += 1
+            self.done.set()
+
+class Latencies:
+    """Collected samples with percentiles"""
+
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.samples.append(value)
+
+    def summary(self, scale=1.0, unit="ms"):
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return "no samples"
+        def pick(fraction):
+            return samples[min(int(fraction * len(samples)), len(samples) - 1)] * scale
+        return (f"n={len(samples)} p50={pick(0.5):.2f} p99={pick(0.99):.2f} "
+                f"p99.9={pick(0.999):.2f} max={samples[-1] * scale:.2f} {unit}")
+
+def install_fake_modules():
+    """Make 'import RPi.GPIO' and 'import smbus' work off the Pi"""
+    gpio = FakeGPIO()
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+    sys.modules.setdefault("RPi", rpi)
+    sys.modules.setdefault("RPi.GPIO", gpio)
+    smbus = types.ModuleType("smbus")
+    smbus.SMBus = lambda bus: FakeBus()
+    sys.modules.setdefault("smbus", smbus)
+
+class Soak(abc.ABC):
+    """Common run logic; subclasses wire up one script"""
+
+    name = None
+
+    def __init__(self, hours, seed, directory, faults=None):
+        self.hours = hours
+        self.faults = faults or {}
+        self.rng = random.Random(seed)
+        self.directory = directory
+        self.clock = VirtualClock()
+        self.end_time = self.clock.now + hours * 3600
+        self.failures = []
+        self.failure_counts = collections.Counter()
+        self.credit_latency = Latencies()
+        self.credited = collections.Counter()
+        self.output = io.StringIO()
+
+    def fail(self, message):
+        self.failure_counts[message.split(":")[0]] += 1
+        if len(self.failures) < 20:
+            self.failures.append(f"[{self.clock.monotonic():10.2f}] {message}")
+
+    @abc.abstractmethod
+    def load(self):
+        """Import the script with fake hardware and return it"""
+
+    @abc.abstractmethod
+    def check_step(self, previous, now):
+        """Invariants that must hold after every loop step"""
+
+    @abc.abstractmethod
+    def finish(self):
+        """Invariants checked once the script has stopped"""
+
+    @abc.abstractmethod
+    def details(self):
+        """Report lines for this script"""
+
+    def run(self):
+        os.environ.pop("NOTIFY_SOCKET", None)
+        os.environ.pop("WATCHDOG_USEC", None)
+        install_fake_modules()
+        module = self.load()
+        world = self.world
+        self.clock.hooks.append(world.step)
+        self.clock.hooks.append(self.check_step)
+        self.clock.hooks.append(self.stop_when_done)
+        self.clock.driver = threading.get_ident()
+        started = _real_monotonic()
+        stdin = sys.stdin
+        sys.stdin = io.StringIO("")  # Console threads see end of input
+        try:
+            with contextlib.redirect_stdout(self.output):
+                module.main()
+        finally:
+            sys.stdin = stdin
+            self.clock.stop()
+        self.real_time = _real_monotonic() - started
+        self.finish()
+        return self.report()
+
+    def stop_when_done(self, previous, now):
+        if (now >= self.end_time and self.world.idle(now) and self.module.running
+                and (self.drained() or now >= self.end_time + DRAIN_TIME)):
+            self.module.running = False
+
+    def drained(self):
+        """Nothing left for the script to retry"""
+        return True
+
+    def throughput(self):
+        virtual = self.clock.now - self.clock.origin
+        pulses = sum(self.world.pulses[v] * n for v, n in self.world.inserted.items())
+        events = self.clock.steps + pulses + self.world.presses + sum(self.world.motor_runs)
+        return [
+            f"Simulated {virtual / 3600:.2f} h in {self.real_time:.1f} s ({virtual / self.real_time:.0f}x real time)",
+            f"Events: {events:,} ({self.clock.steps:,} clock steps, {pulses:,} coin pulses, "
+            f"{self.world.presses:,} purchases, {sum(self.world.motor_runs):,} motor runs, "
+            f"{self.gpio.reads:,} GPIO reads) = {events / self.real_time:,.0f} events/s",
+        ]
+
+    def report(self):
+        lines = [f"== soak {self.name}: {self.hours} h simulated =="] + self.throughput() + self.details()
+        if self.failures:
+            lines.append(f"FAILED: {sum(self.failure_counts.values())} invariant violations")
+            for kind, count in self.failure_counts.most_common():
+                lines.append(f"  {count:6d} x {kind}")
+            lines += ["  " + failure for failure in self.failures]
+        else:
+            lines.append("PASSED: all invariants held")
+        return not self.failures, "\n".join(lines)
+
+    def check_coins(self):
+        if self.credited != self.world.inserted:
+            self.fail(f"lost or miscounted coins: inserted {dict(self.world.inserted)}, "
+                      f"credited {dict(self.credited)}")
+
+class CoinslotSoak(Soak):
+    name = "coinslot"
+
+    INITIAL_STOCK = 150
+    RESTOCK = 120  # Per relay, every simulated hour
+
+    def load(self):
+        import coinslot
+        import dispense_telemetry
+        from ringlog import RingLogger
+        self.module = module = coinslot
+        self.gpio = FakeGPIO()
+        import firebase_tx
+        import remote_commands
+        faults = {name: self.faults.get(name, 0.0) for name in ("error_rate", "lost_reply_rate")}
+        self.emulator = FirebaseEmulator(data={
+            "inventory": {"relay1": self.INITIAL_STOCK, "relay2": self.INITIAL_STOCK},
+            "money_collected": 0,
+        }, faults=faults, seed=self.rng.random()).start()
+        # Latency is added in simulated time by timed_request below: the emulator's own delay is real
+        # time, which the fast clock would stretch a hundredfold
+        self.fault_rng = random.Random(self.rng.random())
+        self.partitioned = False
+        self.healed = False
+        self.clock.hooks.append(self.apply_faults)
+        # Everything the script opens goes to a scratch directory
+        module.GPIO = self.gpio
+        module.time = self.clock
+        dispense_telemetry.time = self.clock
+        firebase_tx.time = self.clock        # Conflict backoff
+        remote_commands.time = self.clock    # Reconnect backoff
+        module.FIREBASE_HOST = self.emulator.url
+        module.MACHINE_ID = "soak"
+        module.STATUS_PORT = 0
+        module.CONFIG_FILE = os.path.join(self.directory, "coinslot.json")
+        module.STATE_FILE = os.path.join(self.directory, "coinslot.state")
+        module.METRICS_DIR = os.path.join(self.directory, "metrics")
+        module.TELEMETRY_FILE = os.path.join(self.directory, "coinslot.telemetry.json")
+        module.is_service = lambda: False
+        module.getch = self.getch
+        self.log_output = io.StringIO()
+        module.log = RingLogger("coinslot", level="WARNING", stream=self.log_output, json_output=True)
+        module.running = True
+
+        self.world = World(self.clock, self.rng, {
+            "coin": module.COIN_PIN,
+            "buttons": (module.BUTTON1_PIN, module.BUTTON2_PIN),
+            "relays": (module.RELAY1_PIN, module.RELAY2_PIN),
+            "irs": (module.IR1_PIN, module.IR2_PIN),
+        }, module.coin_values, module.MINIMUM_AMOUNT, self.end_time, module.COIN_TIMEOUT)
+        self.world.purchase_methods = ("button", "button", "key")
+        self.gpio.world = self.world
+        self.price = module.MINIMUM_AMOUNT
+        self.restock_ids = {1: [], 2: []}
+        self.next_restock = self.clock.now + 3600
+        self.clock.hooks.append(self.push_restock)
+
+        # Measure the script's own calls
+        self.firebase_latency = Latencies()
+        firebase_request = module.firebase_request
+        latency = self.faults.get("latency", 0.0)
+        def timed_request(method, url, **kwargs):
+            if latency:
+                self.clock.sleep(latency * self.fault_rng.uniform(0.5, 1.5))
+            start = _real_monotonic()
+            try:
+                return firebase_request(method, url, **kwargs)
+            finally:
+                self.firebase_latency.add(_real_monotonic() - start)
+        module.firebase_request = timed_request
+        credit_coin = module.credit_coin
+        def counted_credit(pulses):
+            slot = module.coin_table.index(pulses)
+            value = module.coin_table.centavos[slot] / 100
+            if value:
+                self.credited[value] += 1
+            else:
+                self.fail(f"unknown coin: {pulses} pulses")
+            credit_coin(pulses)
+        module.credit_coin = counted_credit
+        return module
+
+    def getch(self):
+        """Keyboard input from the simulated customers"""
+        keys = self.world.keys
+        while self.module.running:
+            if keys and keys[0][0] <= self.clock.now:
+                return keys.popleft()[1]
+            self.clock.sleep(0.05)
+        return "x"
+
+    def push_restock(self, previous, now):
+        """Queue a restock of both relays every hour, as the dashboard would (bypassing injected faults)"""
+        if now >= self.next_restock and now < self.end_time:
+            self.next_restock += 3600
+            for relay in (1, 2):
+                command_id = self.emulator.push_ids.next_id()
+                self.emulator.db.put(["commands", "soak", "queue", command_id],
+                                     {"type": "restock", "args": {"relay": relay, "count": self.RESTOCK}})
+                self.restock_ids[relay].append(command_id)
+
+    def apply_faults(self, previous, now):
+        """Cut the network for the first --partition minutes of every hour; heal it once the run ends"""
+        minutes = self.faults.get("partition", 0)
+        partitioned = now < self.end_time and (now - self.clock.origin) % 3600 < minutes * 60
+        if now >= self.end_time and not self.healed:
+            self.emulator.set_faults(replace=True)
+            self.healed = True
+        if partitioned != self.partitioned:
+            self.emulator.set_faults(partition=partitioned)
+            self.partitioned = partitioned
+
+    def drained(self):
+        module = self.module
+        return (not module.unsynced_money and not module.unsent_transactions
+                and not any(module.pending_inventory.values())
+                and self.emulator.db.get(["commands", "soak", "queue"]) is None)
+
+    def check_step(self, previous, now):
+        module = self.module
+        if module.credit_centavos < 0:
+            self.fail(f"negative credit: {module.credit_centavos / 100:.2f}")
+        if module.relay1_inventory < 0 or module.relay2_inventory < 0:
+            self.fail(f"negative inventory: {module.relay1_inventory}, {module.relay2_inventory}")
+
+    def finish(self):
+        module = self.module
+        world = self.world
+        time.sleep(0.5)  # Let the last Firebase writes and acks land
+        db = self.emulator.db
+        self.check_coins()
+        inserted = sum(value * count for value, count in world.inserted.items())
+        charged = self.price * sum(world.motor_runs)
+        if abs(inserted - (module.credit_centavos / 100 + charged)) > 1e-6:
+            self.fail(f"money not conserved: inserted {inserted:.2f}, credit {module.credit_centavos / 100:.2f} "
+                      f"+ vends {charged:.2f}")
+        # Whatever is still waiting for a retry counts, as it is kept for the next run
+        money = db.get(["money_collected"])
+        collected = (money["total"] if isinstance(money, dict) else money or 0) + module.unsynced_money / 100
+        if abs(collected - inserted) > 1e-6:
+            self.fail(f"Firebase money_collected {collected:.2f} (with unsent) != inserted {inserted:.2f}")
+        transactions = len(db.get(["transactions"]) or {}) + len(module.unsent_transactions)
+        if transactions != sum(world.motor_runs):
+            self.fail(f"Firebase has {transactions} transactions (with unsent) for {sum(world.motor_runs)} vends")
+        acks = db.get(["commands", "soak", "acks"]) or {}
+        for relay in (1, 2):
+            restocked = sum(1 for command_id in self.restock_ids[relay]
+                            if acks.get(command_id, {}).get("status") == "done")
+            if restocked != len(self.restock_ids[relay]):
+                self.fail(f"relay{relay}: {len(self.restock_ids[relay])} restock commands sent, "
+                          f"{restocked} acknowledged")
+            expected = self.INITIAL_STOCK + self.RESTOCK * restocked - world.motor_runs[relay - 1]
+            remote = db.get(["inventory", f"relay{relay}"])
+            local = getattr(module, f"relay{relay}_inventory")
+            if remote is None or remote + module.pending_inventory[relay] != expected or local != expected:
+                self.fail(f"inventory relay{relay}: expected {expected}, local {local}, "
+                          f"Firebase {remote} + pending {module.pending_inventory[relay]}")
+            if remote is not None and remote < 0:
+                self.fail(f"negative inventory in Firebase: relay{relay} = {remote}")
+        limit = dispense_limit(module.telemetry)
+        if world.longest_run > limit:
+            self.fail(f"motor ran {world.longest_run:.1f} s (limit {limit:.1f} s)")
+        self.emulator.stop()
+
+    def describe_faults(self):
+        if not self.faults:
+            return "none"
+        settings = ", ".join(f"{key} {value}" for key, value in self.faults.items())
+        injected = self.emulator.stats().get("faults", {})
+        left = ("all synced" if self.drained() else
+                f"left to retry: P{self.module.unsynced_money / 100:.2f}, "
+                f"{len(self.module.unsent_transactions)} sales, inventory {self.module.pending_inventory}")
+        return f"{settings} -> injected {injected}; {left}"
+
+    def details(self):
+        module = self.module
+        world = self.world
+        loop = module.loop_monitor.stats()
+        log_lines = [json.loads(line) for line in self.log_output.getvalue().splitlines() if line.startswith("{")]
+        levels = collections.Counter(line["level"] for line in log_lines)
+        errors = [line["msg"] for line in log_lines if line["level"] == "ERROR"][:5]
+        lines = [
+            f"Coins: {sum(world.inserted.values()):,} inserted ({dict(sorted(world.inserted.items()))}), "
+            f"credit left P{module.credit_centavos / 100:.2f}",
+            f"Vends: {world.motor_runs} motor runs, {world.delivered} delivered, {world.jams} jams",
+            f"Loop iteration (real): p50 {loop['p50_ms']} ms, p99 {loop['p99_ms']} ms, max {loop['max_ms']} ms, "
+            f"{loop['overruns']} overruns",
+            f"Firebase request (real): {self.firebase_latency.summary(1000)}",
+            f"Firebase faults: {self.describe_faults()}",
+            f"Motor run (simulated): {summarize(world.run_times)}",
+            f"Dispensers: " + ", ".join(f"relay{name} {stats['health']} (drift {stats['ir_time_drift']}, "
+                                        f"timeout {stats['timeout_s']} s)"
+                                        for name, stats in module.telemetry.stats().items()),
+            f"Log: {dict(levels)}",
+        ]
+        lines += [f"  error: {message}" for message in errors]
+        return lines
+
+class VendoSoak(Soak):
+    name = "vendo"
+
+    def load(self):
+        import vendo
+        import dispense_telemetry
+        self.module = module = vendo
+        self.gpio = FakeGPIO()
+        module.GPIO = self.gpio
+        module.time = self.clock
+        dispense_telemetry.time = self.clock
+        module.CONFIG_FILE = os.path.join(self.directory, "vendo.json")
+        module.STATE_FILE = os.path.join(self.directory, "vendo.state")
+        module.TELEMETRY_FILE = os.path.join(self.directory, "vendo.telemetry.json")
+        module.COMMAND_SOCKET = os.path.join(self.directory, "vendo.sock")
+        module.running = True
+
+        self.world = World(self.clock, self.rng, {
+            "coin": module.COIN_SLOT,
+            "buttons": (module.BUTTON_WINGS, module.BUTTON_REGULAR),
+            "relays": (module.MOTOR_WINGS, module.MOTOR_REGULAR),
+            "irs": (module.IR_SENSOR_WINGS, module.IR_SENSOR_REGULAR),
+        }, module.coin_values, module.PRICE, self.end_time, module.COIN_TIMEOUT)
+        self.world.purchase_methods = ("button", "button", "socket")
+        self.gpio.world = self.world
+        self.price = module.PRICE
+        self.edges = EdgeDispatcher(self.gpio, self.world, module.COIN_SLOT)
+        self.clock.hooks.insert(0, self.edges.step)
+        # Stop the clock at every edge so each interrupt sees its own time
+        self.clock.event_sources.append(lambda: self.world.coin_edges[0] if self.world.coin_edges else None)
+        self.console = threading.Thread(target=self.console_loop, daemon=True)
+        self.console.start()
+        self.console_latency = Latencies()
+        self.console_results = collections.Counter()
+
+        handle_coin_slot = module.handle_coin_slot
+        def counted_handle(force=False):
+            pulses = module.coin_pulse_count
+            value = handle_coin_slot(force)
+            if value:
+                self.credited[value] += 1
+            elif pulses and not module.coin_pulse_count:
+                self.fail(f"invalid coin: {pulses} pulses")
+            return value
+        module.handle_coin_slot = counted_handle
+        return module
+
+    def console_loop(self):
+        """Send the socket purchases (and a periodic health check) like a scripted console"""
+        from command_socket import send_commands
+        commands = self.world.socket_commands
+        next_health = self.clock.now + 60
+        while not self.clock.stopped:
+            batch = []
+            while commands and commands[0][0] <= self.clock.now:
+                batch.append(commands.popleft()[1])
+            if self.clock.now >= next_health:
+                batch.append("health")
+                next_health += 60
+            if batch:
+                start = _real_monotonic()
+                try:
+                    reply = send_commands(batch, self.module.COMMAND_SOCKET)
+                    for result in reply.get("results", []):
+                        outcome = result["result"] if isinstance(result["result"], str) else "ok"
+                        self.console_results[f"{result['command']} {outcome}"[:40]] += 1
+                except OSError as e:
+                    self.console_results[f"socket error: {e}"[:40]] += 1
+                self.console_latency.add(_real_monotonic() - start)
+            self.clock.sleep(0.1)
+
+    def check_step(self, previous, now):
+        if self.module.credit < 0:
+            self.fail(f"negative credit: {self.module.credit}")
+
+    def finish(self):
+        module = self.module
+        world = self.world
+        self.edges.running = False
+        self.check_coins()
+        inserted = sum(value * count for value, count in world.inserted.items())
+        # Timeouts are refunded, so only delivered napkins are paid for
+        charged = self.price * sum(world.delivered)
+        if inserted != module.credit + charged:
+            self.fail(f"money not conserved: inserted {inserted}, credit {module.credit} + vends {charged}")
+        limit = dispense_limit(module.telemetry)
+        if world.longest_run > limit:
+            self.fail(f"motor ran {world.longest_run:.1f} s (limit {limit:.1f} s)")
+
+    def details(self):
+        module = self.module
+        world = self.world
+        loop = module.loop_monitor.stats()
+        return [
+            f"Coins: {sum(world.inserted.values()):,} inserted ({dict(sorted(world.inserted.items()))}), "
+            f"{self.edges.delivered:,} pulse interrupts, credit left P{module.credit}",
+            f"Vends: {world.motor_runs} motor runs, {world.delivered} delivered, {world.jams} jams",
+            f"Loop iteration (real): p50 {loop['p50_ms']} ms, p99 {loop['p99_ms']} ms, max {loop['max_ms']} ms, "
+            f"{loop['overruns']} overruns",
+            f"Socket command (real): {self.console_latency.summary(1000)}",
+            f"Socket results: {dict(self.console_results.most_common(6))}",
+            f"Motor run (simulated): {summarize(world.run_times)}",
+            f"Dispensers: " + ", ".join(f"{name} {stats['health']} (drift {stats['ir_time_drift']}, "
+                                        f"timeout {stats['timeout_s']} s)"
+                                        for name, stats in module.telemetry.stats().items()),
+        ]
+
+def dispense_limit(telemetry):
+    """Longest a motor may run: the largest adaptive timeout plus run-on and one loop step"""
+    return telemetry.max_timeout + 2.0 + 0.5
+
+def summarize(samples):
+    latencies = Latencies()
+    latencies.samples = list(samples)
+    return latencies.summary(1, "s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test coinslot.py or vendo.py against simulated hardware")
+    parser.add_argument("script", choices=("coinslot", "vendo"))
+    parser.add_argument("--hours", type=float, default=4.0, help="Simulated hours (default 4)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch directory")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Mean Firebase delay per request, simulated seconds (coinslot)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of Firebase requests answered with a 5xx error (coinslot)")
+    parser.add_argument("--lost-reply-rate", type=float, default=0.0,
+                        help="Fraction of Firebase requests carried out with their response dropped (coinslot)")
+    parser.add_argument("--partition", type=float, default=0.0,
+                        help="Minutes of every simulated hour Firebase is unreachable (coinslot)")
+    args = parser.parse_args()
+    faults = {key: value for key, value in (("latency", args.latency), ("error_rate", args.error_rate),
+                                            ("lost_reply_rate", args.lost_reply_rate),
+                                            ("partition", args.partition)) if value}
+    if faults and args.script != "coinslot":
+        parser.error("Firebase faults only apply to coinslot")
+
+    directory = tempfile.mkdtemp(prefix=f"soak-{args.script}-")
+    soak_class = CoinslotSoak if args.script == "coinslot" else VendoSoak
+    try:
+        passed, report = soak_class(args.hours, args.seed, directory, faults).run()
+    finally:
+        if args.keep:
+            print(f"Scratch files kept in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(report)
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
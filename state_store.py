@@ -0,0 +1,110 @@
+"""
+Crash-safe machine state snapshot
+Keeps credit, in-flight vends, inventory and inventory changes not yet
+sent to Firebase in a small memory-mapped file
+so they survive a service restart:
+- Two fixed-size slots are written alternately, each with a sequence
+  number and CRC, so a torn write always leaves the previous slot intact
+- Writes go to the shared mapping, so a crash of the process loses nothing
+- msync() runs in the background at most once per flush interval, which
+  bounds both the cost of a save and what a power cut can lose
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"VST2"
+CHANNELS = 2
+
+# magic, sequence, saved_at, credit (centavos), inventory x2, in-flight amount x2 (centavos),
+# pending inventory delta x2, inventory delta being sent x2 (sequence, delta)
+SLOT_FORMAT = "<4sQdqii2q2i2q2i"
+SLOT_SIZE = struct.calcsize(SLOT_FORMAT) + 4  # + CRC32
+FILE_SIZE = 2 * SLOT_SIZE
+
+class StateStore:
+    """Double-buffered state snapshot in a memory-mapped file"""
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+            self.mm = mmap.mmap(fd, FILE_SIZE)
+        finally:
+            os.close(fd)
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.closed = False
+        snapshot = self.load()
+        self.seq = snapshot["seq"] if snapshot else 0
+        self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def _read_slot(self, index):
+        raw = self.mm[index * SLOT_SIZE:(index + 1) * SLOT_SIZE]
+        body, crc = raw[:-4], struct.unpack("<I", raw[-4:])[0]
+        if zlib.crc32(body) != crc:
+            return None
+        (magic, seq, saved_at, credit, inv1, inv2, inflight1, inflight2, pending1, pending2,
+         sent_seq1, sent_seq2, sent1, sent2) = struct.unpack(SLOT_FORMAT, body)
+        if magic != MAGIC:
+            return None
+        return {
+            "seq": seq,
+            "saved_at": saved_at,
+            "credit": credit,
+            "inventory": [inv1, inv2],
+            "inflight": [inflight1, inflight2],
+            "pending": [pending1, pending2],
+            "sending": [(sent_seq1, sent1), (sent_seq2, sent2)],
+        }
+
+    def load(self):
+        """Return the newest valid snapshot, or None if there is none"""
+        slots = [s for s in (self._read_slot(0), self._read_slot(1)) if s]
+        if not slots:
+            return None
+        return max(slots, key=lambda s: s["seq"])
+
+    def save(self, credit, inventory, inflight, pending=(0, 0), sending=((0, 0), (0, 0))):
+        """Store a new snapshot (credit and in-flight amounts in centavos)"""
+        with self.lock:
+            if self.closed:
+                return
+            self.seq += 1
+            body = struct.pack(SLOT_FORMAT, MAGIC, self.seq, time.time(), int(credit),
+                               int(inventory[0]), int(inventory[1]),
+                               int(inflight[0]), int(inflight[1]),
+                               int(pending[0]), int(pending[1]),
+                               int(sending[0][0]), int(sending[1][0]),
+                               int(sending[0][1]), int(sending[1][1]))
+            offset = (self.seq % 2) * SLOT_SIZE
+            self.mm[offset:offset + SLOT_SIZE] = body + struct.pack("<I", zlib.crc32(body))
+        self.dirty.set()
+
+    def _flush_loop(self):
+        """Push dirty pages to storage, at most once per flush interval"""
+        while not self.closed:
+            self.dirty.wait()
+            self.dirty.clear()
+            with self.lock:
+                if self.closed:
+                    break
+                self.mm.flush()
+            time.sleep(self.flush_interval)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.mm.flush()
+            self.mm.close()
+        self.dirty.set()
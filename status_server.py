@@ -0,0 +1,150 @@
+"""
+LAN status server
+A small asyncio HTTP server that answers from the machine's memory, so
+local dashboards can watch it without any Firebase traffic. Each route is
+a function returning JSON-serializable data:
+    GET /status                       live state snapshot
+    GET /status?since=<v>&wait=<s>    long-poll: waits up to <s> seconds
+                                      until the state version passes <v>
+Functions in 'query_routes' instead receive the parsed query string
+({name: [values]}) and run in a worker thread, since they may block on
+disk. Every reply carries the current state
+version; callers bump it with notify() from any thread whenever the
+state changes.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+MAX_WAIT = 60  # Longest long-poll wait (seconds)
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error"}
+
+class StatusServer:
+    """Serve JSON routes over HTTP from a background asyncio loop"""
+
+    def __init__(self, routes, host="0.0.0.0", port=8080, log=None, query_routes=None):
+        self.routes = dict(routes)  # path -> function returning data
+        for path, route in (query_routes or {}).items():
+            self.routes[path] = route
+        self.query_routes = set(query_routes or ())
+        self.host = host
+        self.port = port
+        self.log = log
+        self.version = 0
+        self.loop = None
+        self.changed = None
+        self.ready = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        self.ready.wait(5)
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.changed = asyncio.Condition()
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_client, self.host, self.port))
+        except OSError as e:
+            if self.log:
+                self.log.error("Status server failed to start on port %s: %s", self.port, e)
+            self.ready.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        if self.log:
+            self.log.info("Status server listening on port %s", self.port)
+        self.ready.set()
+        self.loop.run_forever()
+
+    def notify(self):
+        """Mark the state as changed and wake long-poll requests (thread-safe)"""
+        self.version += 1
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._wake()))
+
+    async def _wake(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "Malformed request"}, False)
+                    break
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, body = await self._dispatch(method, target)
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target):
+        if method != "GET":
+            return 405, {"error": "Only GET is supported"}
+        url = urlsplit(target)
+        route = self.routes.get(url.path.rstrip("/") or "/")
+        if route is None:
+            return 404, {"error": "Unknown path", "paths": sorted(self.routes)}
+        query = parse_qs(url.query)
+        try:
+            since = int(query["since"][0]) if "since" in query else None
+            wait = min(float(query.get("wait", ["30"])[0]), MAX_WAIT)
+        except ValueError:
+            return 400, {"error": "'since' and 'wait' must be numbers"}
+        if since is not None and self.version <= since:
+            # Long-poll: hold the request until the state changes or the wait runs out
+            deadline = time.monotonic() + wait
+            async with self.changed:
+                while self.version <= since:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self.changed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+        try:
+            if url.path.rstrip("/") in self.query_routes:
+                # Query routes may read files (metrics history), so keep them off the loop
+                data = await self.loop.run_in_executor(None, route, query)
+            else:
+                data = route()
+            return 200, {"version": self.version, "data": data}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    async def _respond(self, writer, status, body, keep_alive):
+        payload = json.dumps(body, default=str).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json\r\n"
+                "Access-Control-Allow-Origin: *\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + payload)
+        await writer.drain()
@@ -0,0 +1,35 @@
+"""Tests for rrd.MetricStore: python3 -m unittest test_rrd"""
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from rrd import MetricStore
+
+class FetchRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="rrd-test-")
+        self.store = MetricStore(self.directory)
+        self.now = int(time.time())  # On a 1 s slot boundary, so points come back at the recorded times
+        for age in (300, 120, 30):
+            self.store.record("coins_5", 5, timestamp=self.now - age)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def times(self, start, end=None):
+        return [round(self.now - p["t"]) for p in self.store.fetch("coins_5", start, end)["points"]]
+
+    def test_negative_start_is_seconds_ago(self):
+        self.assertEqual(self.times(-200), [120, 30])
+
+    def test_negative_end_is_seconds_ago(self):
+        self.assertEqual(self.times(-600, -60), [300, 120])
+
+    def test_absolute_times(self):
+        self.assertEqual(self.times(self.now - 600, self.now - 60), [300, 120])
+
+if __name__ == "__main__":
+    unittest.main()
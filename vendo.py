@@ -11,24 +11,74 @@ Includes coin slot functionality:
 
 import RPi.GPIO as GPIO
 import smbus
+import os
 import time
 import threading
-from RPLCD.i2c import CharLCD
+from lcd_transport import BatchedLCD
+from state_store import StateStore
+from command_socket import CommandSocketServer, DEFAULT_SOCKET
+from loop_monitor import LoopMonitor
+from dispense_telemetry import DispenseTelemetry, wait_for_ir
+from config import ConfigReloader, require_distinct_pins, require_positive
+import sdnotify
 
-# Pin Definitions (BCM numbering)
-BUTTON_WINGS = 2         # Button for selecting napkin with wings
-BUTTON_REGULAR = 3       # Button for selecting regular napkin
-MOTOR_WINGS = 4          # Relay for controlling motor for napkins with wings
-MOTOR_REGULAR = 5        # Relay for controlling motor for regular napkins
-IR_SENSOR_WINGS = 6      # IR sensor for detecting napkin with wings dispensed
-IR_SENSOR_REGULAR = 7    # IR sensor for detecting regular napkin dispensed
-COIN_SLOT = 8            # Single coin slot sensor for all coin types
+# Settings: these defaults can be overridden in vendo.json and reloaded
+# live with SIGHUP or the "reload" command (see config.py)
+DEFAULT_CONFIG = {
+    # Pin Definitions (BCM numbering)
+    "BUTTON_WINGS": 2,         # Button for selecting napkin with wings
+    "BUTTON_REGULAR": 3,       # Button for selecting regular napkin
+    "MOTOR_WINGS": 4,          # Relay for controlling motor for napkins with wings
+    "MOTOR_REGULAR": 5,        # Relay for controlling motor for regular napkins
+    "IR_SENSOR_WINGS": 6,      # IR sensor for detecting napkin with wings dispensed
+    "IR_SENSOR_REGULAR": 7,    # IR sensor for detecting regular napkin dispensed
+    "COIN_SLOT": 8,            # Single coin slot sensor for all coin types
+    "COIN_DEBOUNCE_TIME": 0.05,  # 50ms debounce for coin slot
+    "COIN_TIMEOUT": 1.0,         # 1000ms timeout for pulse sequence
+    "PRICE": 10,                 # Pesos per napkin
+    # Pulse count -> pesos, allowing for slight variations
+    "coin_values": {1: 1, 4: 5, 5: 5, 6: 5, 9: 10, 10: 10, 11: 10},
+}
+CONFIG_FILE = os.environ.get("VENDO_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendo.json"))
+
+INPUT_PINS = ("BUTTON_WINGS", "BUTTON_REGULAR", "IR_SENSOR_WINGS", "IR_SENSOR_REGULAR", "COIN_SLOT")
+MOTOR_PINS = ("MOTOR_WINGS", "MOTOR_REGULAR")
+
+def validate_config(config):
+    require_distinct_pins(config, INPUT_PINS + MOTOR_PINS)
+    require_positive(config, "COIN_DEBOUNCE_TIME", "COIN_TIMEOUT", "PRICE", "coin_values")
+
+def setup_pin(name, pin):
+    """Configure one pin: inputs with pull-ups, motors start OFF"""
+    if name in INPUT_PINS:
+        GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+    else:
+        GPIO.setup(pin, GPIO.OUT)
+        GPIO.output(pin, GPIO.HIGH)  # Relays are active LOW
+    if name == "COIN_SLOT":
+        # Set up interrupt handler for coin slot
+        GPIO.add_event_detect(pin, GPIO.FALLING, callback=coin_slot_callback, bouncetime=50)
+
+def apply_config(config, changed):
+    """Switch to new settings (called from the main loop, see reload_config_if_idle)"""
+    for name in INPUT_PINS + MOTOR_PINS:
+        if name in changed:
+            if name == "COIN_SLOT":
+                GPIO.remove_event_detect(COIN_SLOT)
+            GPIO.cleanup(globals()[name])
+            setup_pin(name, config[name])
+    globals().update(config)
+    update_lcd()
+
+config_reloader = None  # Loads CONFIG_FILE in initialize()
+globals().update(DEFAULT_CONFIG)
 
 # LCD Setup
 I2C_ADDR = 0x27  # I2C device address
 I2C_BUS = 1      # Typically 1 on newer Raspberry Pi models
 
 # Global variables
+running = True
 credit = 0
 dispensing = False
 coin_open = False  # Track if the coin input mode is active
@@ -37,25 +87,82 @@ coin_open = False  # Track if the coin input mode is active
 coin_pulse_count = 0
 last_coin_time = 0
 last_coin_process_time = 0
-COIN_DEBOUNCE_TIME = 0.05   # 50ms debounce for coin slot
-COIN_TIMEOUT = 1.0         # 1000ms timeout for pulse sequence
 
 # Lock for thread safety
 pulse_lock = threading.Lock()
+command_lock = threading.Lock()  # Serializes console and socket commands with the main loop's buttons and coins
+
+# Main loop health: runs every 50 ms, iterations over 250 ms are reported with the blocking call
+loop_monitor = LoopMonitor("Main loop", period=0.05, budget=0.25)
+
+# Motor-to-IR timing per channel: adaptive dispense timeouts and jam warnings
+TELEMETRY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendo.telemetry.json")
+DISPENSE_MAX_TIMEOUT = 11.0  # Worst-case vend 13.8 s, see initialize()
+VEND_TIME_LIMIT = DISPENSE_MAX_TIMEOUT + 3.0  # Longest a vend may hold the main loop (timeout + run-on + message)
+telemetry = None  # Loaded in initialize()
+
+# Unix socket for scripted control (see command_socket.py)
+COMMAND_SOCKET = os.environ.get("VENDO_SOCKET", DEFAULT_SOCKET)
+
+# Simulated hardware for scripted runs over the socket: vends succeed at once, with no motor,
+# IR sensor or LCD message wait (otherwise each vend holds the socket for at least 2.5 s)
+SIMULATE_HARDWARE = os.environ.get("VENDO_SIMULATE", "") == "1"
+
+# Crash-safe snapshot of credit and in-flight vends
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vendo.state")
+state_store = None  # Opened in initialize()
+
+lcd = None  # Opened in initialize()
+
+class DummyLCD:
+    """Stand-in used when the LCD cannot be opened, to prevent crashes"""
+    def clear(self): pass
+    def cursor_pos(self, pos): pass
+    def write_string(self, text): 
+        print(f"LCD: {text}")
+    def write_frame(self, *lines):
+        print(f"LCD: {' | '.join(lines)}")
+
+def initialize():
+    """Open the LCD and the settings, state and telemetry files"""
+    global lcd, config_reloader, state_store, telemetry
+    config_reloader = ConfigReloader(CONFIG_FILE, DEFAULT_CONFIG, apply_config, validate_config)
+    globals().update(config_reloader.config)
+    state_store = StateStore(STATE_FILE)
+    # Vends run on the main loop, which the loop monitor excuses for up to VEND_TIME_LIMIT: a jammed one
+    # (timeout + 0.5 s run-on + 2 s message) must end within it, or the watchdog pings stop mid-vend
+    telemetry = DispenseTelemetry(("wings", "regular"), TELEMETRY_FILE, default_timeout=10.0,
+                                  max_timeout=DISPENSE_MAX_TIMEOUT)
+    
+    # Initialize LCD
+    try:
+        lcd = BatchedLCD(smbus.SMBus(I2C_BUS), address=I2C_ADDR,
+                         cols=16, rows=2, backlight_enabled=True)
+    except Exception as e:
+        print(f"LCD initialization error: {e}")
+        lcd = DummyLCD()
 
-# Initialize LCD
-try:
-    lcd = CharLCD(i2c_expander='PCF8574', address=I2C_ADDR, port=I2C_BUS,
-                  cols=16, rows=2, backlight_enabled=True)
-except Exception as e:
-    print(f"LCD initialization error: {e}")
-    # If LCD fails, create a dummy LCD to prevent crashes
-    class DummyLCD:
-        def clear(self): pass
-        def cursor_pos(self, pos): pass
-        def write_string(self, text): 
-            print(f"LCD: {text}")
-    lcd = DummyLCD()
+def save_state(dispensing_channel=0):
+    """Save credit and the in-flight vend (channel 1 or 2) to the state file"""
+    inflight = [0, 0]
+    if dispensing_channel:
+        inflight[dispensing_channel - 1] = PRICE * 100
+    state_store.save(credit * 100, (0, 0), inflight)
+
+def restore_state():
+    """Restore credit saved before the last exit or crash"""
+    global credit
+    snapshot = state_store.load()
+    if not snapshot:
+        return
+    credit = snapshot["credit"] // 100
+    # A vend interrupted by a crash is refunded, like a dispense timeout
+    refund = sum(snapshot["inflight"]) // 100
+    if refund:
+        print(f"Refunding {refund} pesos for a vend interrupted by a restart")
+        credit += refund
+    save_state()
+    print(f"State restored. Current credit: {credit}")
 
 def setup():
     """Initialize GPIO and setup pins"""
@@ -63,28 +170,12 @@ def setup():
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
     
-    # Setup pin modes
-    GPIO.setup(BUTTON_WINGS, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    GPIO.setup(BUTTON_REGULAR, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    GPIO.setup(MOTOR_WINGS, GPIO.OUT)
-    GPIO.setup(MOTOR_REGULAR, GPIO.OUT)
-    GPIO.setup(IR_SENSOR_WINGS, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    GPIO.setup(IR_SENSOR_REGULAR, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    GPIO.setup(COIN_SLOT, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-    
-    # Set up interrupt handler for coin slot
-    GPIO.add_event_detect(COIN_SLOT, GPIO.FALLING, callback=coin_slot_callback, bouncetime=50)
-    
-    # Initialize outputs to OFF (relays are active LOW)
-    GPIO.output(MOTOR_WINGS, GPIO.HIGH)
-    GPIO.output(MOTOR_REGULAR, GPIO.HIGH)
+    # Setup pin modes, motors OFF and the coin slot interrupt
+    for name in INPUT_PINS + MOTOR_PINS:
+        setup_pin(name, globals()[name])
     
     # Initialize LCD display
-    lcd.clear()
-    lcd.cursor_pos = (0, 0)
-    lcd.write_string("Napkin Vending")
-    lcd.cursor_pos = (1, 0)
-    lcd.write_string("Machine Ready")
+    lcd.write_frame("Napkin Vending", "Machine Ready")
     time.sleep(2)
     
     update_lcd()
@@ -92,125 +183,106 @@ def setup():
     # Print instructions to console
     print("Napkin Vending Machine Ready")
     print("Insert coins (pulses represent coin value)")
-    print("1 pulse = 1 peso")
-    print("5 pulses = 5 pesos")
-    print("10 pulses = 10 pesos")
+    for pulses, value in sorted(coin_values.items()):
+        print(f"{pulses} pulses = {value} pesos")
     print("Or type a number to add credits manually")
     print("Enter 'nap-1' to dispense napkin with wings")
     print("Enter 'nap-2' to dispense regular napkin")
-    print("10 credits are required to dispense a napkin")
+    print(f"{PRICE} credits are required to dispense a napkin")
 
 def update_lcd():
     """Update LCD display with current status"""
-    lcd.clear()
-    lcd.cursor_pos = (0, 0)
-    lcd.write_string(f"Credit: {credit} Pesos")
-    
-    lcd.cursor_pos = (1, 0)
-    if credit >= 10:
-        lcd.write_string("nap-1:W nap-2:R")
+    if credit >= PRICE:
+        status = "nap-1:W nap-2:R"
     else:
-        lcd.write_string("Insert coins...")
+        status = "Insert coins..."
+    lcd.write_frame(f"Credit: {credit} Pesos", status)
+
+def run_dispenser(channel, motor, ir_sensor):
+    """Run one motor until its IR sensor sees a napkin; True if one was dispensed"""
+    if SIMULATE_HARDWARE:
+        return True
+    
+    # Start motor
+    GPIO.output(motor, GPIO.LOW)  # Activate relay (active LOW)
+    
+    # Wait for napkin to be detected (timeout adapts to this channel), then let motor complete rotation
+    ir_time, pulse_width = wait_for_ir(lambda: GPIO.input(ir_sensor) == GPIO.LOW,
+                                       telemetry.timeout(channel), run_on=0.5)
+    
+    # Stop motor
+    GPIO.output(motor, GPIO.HIGH)  # Deactivate relay
+    
+    if ir_time is None:
+        telemetry.record_timeout(channel)
+        return False
+    telemetry.record_vend(channel, ir_time, pulse_width)
+    return True
+
+def show_message():
+    """Leave a vend result on the LCD long enough to read"""
+    if not SIMULATE_HARDWARE:
+        time.sleep(2)
 
 def dispense_wings():
     """Function to dispense napkin with wings"""
     global dispensing, credit
     
-    if dispensing or credit < 10:
-        return
+    if dispensing or credit < PRICE:
+        return None
     
     dispensing = True
-    credit -= 10
+    price = PRICE
+    credit -= price
+    save_state(1)
     update_lcd()
     
-    lcd.clear()
-    lcd.cursor_pos = (0, 0)
-    lcd.write_string("Dispensing...")
-    lcd.cursor_pos = (1, 0)
-    lcd.write_string("nap-1: Wings")
-    
-    # Start motor
-    GPIO.output(MOTOR_WINGS, GPIO.LOW)  # Activate relay (active LOW)
-    
-    # Wait for napkin to be detected or timeout
-    start_time = time.time()
-    timeout = 10  # 10 seconds timeout
-    napkin_detected = False
-    
-    while time.time() - start_time < timeout and not napkin_detected:
-        if GPIO.input(IR_SENSOR_WINGS) == GPIO.LOW:  # Object detected
-            napkin_detected = True
-            time.sleep(0.5)  # Let motor complete rotation
-        time.sleep(0.1)
-    
-    # Stop motor
-    GPIO.output(MOTOR_WINGS, GPIO.HIGH)  # Deactivate relay
+    lcd.write_frame("Dispensing...", "nap-1: Wings")
+    napkin_detected = run_dispenser("wings", MOTOR_WINGS, IR_SENSOR_WINGS)
     
     if napkin_detected:
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string("Thank you!")
-        time.sleep(2)
+        lcd.write_frame("Thank you!")
+        show_message()
     else:
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string("Error: Timeout")
-        time.sleep(2)
+        lcd.write_frame("Error: Timeout")
+        show_message()
         # Refund credit if napkin not dispensed
-        credit += 10
+        credit += price
     
     dispensing = False
+    save_state()
     update_lcd()
+    return napkin_detected
 
 def dispense_regular():
     """Function to dispense regular napkin"""
     global dispensing, credit
     
-    if dispensing or credit < 10:
-        return
+    if dispensing or credit < PRICE:
+        return None
     
     dispensing = True
-    credit -= 10
+    price = PRICE
+    credit -= price
+    save_state(2)
     update_lcd()
     
-    lcd.clear()
-    lcd.cursor_pos = (0, 0)
-    lcd.write_string("Dispensing...")
-    lcd.cursor_pos = (1, 0)
-    lcd.write_string("nap-2: Regular")
-    
-    # Start motor
-    GPIO.output(MOTOR_REGULAR, GPIO.LOW)  # Activate relay (active LOW)
-    
-    # Wait for napkin to be detected or timeout
-    start_time = time.time()
-    timeout = 10  # 10 seconds timeout
-    napkin_detected = False
-    
-    while time.time() - start_time < timeout and not napkin_detected:
-        if GPIO.input(IR_SENSOR_REGULAR) == GPIO.LOW:  # Object detected
-            napkin_detected = True
-            time.sleep(0.5)  # Let motor complete rotation
-        time.sleep(0.1)
-    
-    # Stop motor
-    GPIO.output(MOTOR_REGULAR, GPIO.HIGH)  # Deactivate relay
+    lcd.write_frame("Dispensing...", "nap-2: Regular")
+    napkin_detected = run_dispenser("regular", MOTOR_REGULAR, IR_SENSOR_REGULAR)
     
     if napkin_detected:
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string("Thank you!")
-        time.sleep(2)
+        lcd.write_frame("Thank you!")
+        show_message()
     else:
-        lcd.clear()
-        lcd.cursor_pos = (0, 0)
-        lcd.write_string("Error: Timeout")
-        time.sleep(2)
+        lcd.write_frame("Error: Timeout")
+        show_message()
         # Refund credit if napkin not dispensed
-        credit += 10
+        credit += price
     
     dispensing = False
+    save_state()
     update_lcd()
+    return napkin_detected
 
 def coin_slot_callback(channel):
     """Interrupt callback for coin slot pulses"""
@@ -224,44 +296,37 @@ def coin_slot_callback(channel):
             last_coin_time = current_time
             last_coin_process_time = current_time  # Reset the timeout timer
 
-def handle_coin_slot():
-    """Process coin slot pulses and update credit"""
+def handle_coin_slot(force=False):
+    """Process coin slot pulses and update credit (force skips the pulse timeout)"""
     global coin_pulse_count, credit
     
     current_time = time.time()
     
     # If we have pulses and the timeout has occurred, process them
-    if coin_pulse_count > 0 and (current_time - last_coin_time > COIN_TIMEOUT):
+    if coin_pulse_count > 0 and (force or current_time - last_coin_time > COIN_TIMEOUT):
         with pulse_lock:
             # Determine coin value based on pulse count
-            coin_value = 0
-            coin_type = ""
-            
-            if coin_pulse_count == 1:
-                coin_value = 1
-                coin_type = "1 peso"
-            elif 4 <= coin_pulse_count <= 6:  # Allow for slight variations
-                coin_value = 5
-                coin_type = "5 pesos"
-            elif 9 <= coin_pulse_count <= 11:  # Allow for slight variations
-                coin_value = 10
-                coin_type = "10 pesos"
-            else:
+            coin_value = coin_values.get(coin_pulse_count)
+            if coin_value is None:
                 # Invalid pulse count
                 print(f"Invalid coin pulse count: {coin_pulse_count}")
                 coin_pulse_count = 0
-                return
+                return 0
+            coin_type = "1 peso" if coin_value == 1 else f"{coin_value} pesos"
             
             # Add credit and update display
             credit += coin_value
+            save_state()
             print(f"{coin_type} coin detected ({coin_pulse_count} pulses)")
             update_lcd()
             
             # Reset pulse count
             coin_pulse_count = 0
+            return coin_value
+    return 0
 
 def process_command(command):
-    """Process commands from console input"""
+    """Process commands from console or socket input and return a short result"""
     global credit, coin_open
     
     command = command.strip()
@@ -273,7 +338,31 @@ def process_command(command):
             print("Coin slot opened. Type a number to add credits.")
         else:
             print("Coin slot closed.")
-        return
+        return "opened" if coin_open else "closed"
+    
+    # Show main loop timing and the calls that made it overrun
+    if command.lower() == "health":
+        stats = loop_monitor.stats()
+        print(f"Main loop: p50 {stats['p50_ms']} ms, p99 {stats['p99_ms']} ms, "
+              f"max {stats['max_ms']} ms, {stats['overruns']} overruns")
+        for overrun in stats["recent_overruns"]:
+            print(f"  {overrun['duration_ms']} ms in {overrun['culprit']}")
+        dispensers = telemetry.stats()
+        for name, channel in dispensers.items():
+            print(f"Dispenser {name}: {channel['health']}, IR time p50 {channel['ir_time_p50_s']:.2f} s, "
+                  f"drift {channel['ir_time_drift']}, {channel['timeouts']} timeouts, "
+                  f"timeout {channel['timeout_s']} s")
+        return dict(stats, dispensers=dispensers)
+    
+    # Re-read vendo.json once no coin or vend is in progress
+    if command.lower() == "reload":
+        config_reloader.request()
+        return "reload scheduled"
+    
+    # Credit pending coin pulses now instead of waiting for the pulse timeout
+    if command.lower() == "settle":
+        value = handle_coin_slot(force=True)
+        return f"credited {value}" if value else "no coin"
     
     # Check for debug command to simulate coin insertions
     if command.startswith("coin"):
@@ -281,52 +370,70 @@ def process_command(command):
         
         try:
             value = int(coin_value_str)
-            if value in [1, 5, 10]:
+            if value in coin_values.values():
                 print(f"Simulating {value} peso coin insertion with pulses")
                 
-                # Simulate the correct number of pulses
-                pulses_to_simulate = 0
-                
-                if value == 1:
-                    pulses_to_simulate = 1
-                elif value == 5:
-                    pulses_to_simulate = 5
-                elif value == 10:
-                    pulses_to_simulate = 10
+                # Simulate the calibrated pulse count closest to the value
+                pulses_to_simulate = min((p for p, v in coin_values.items() if v == value),
+                                         key=lambda p: abs(p - value))
                 
                 # Add the pulses
                 global coin_pulse_count, last_coin_time
                 with pulse_lock:
                     coin_pulse_count += pulses_to_simulate
                     last_coin_time = time.time()
+                return "pulses"
             else:
-                print("Invalid coin value. Use 1, 5, or 10.")
+                print(f"Invalid coin value. Use one of {sorted(set(coin_values.values()))}.")
         except ValueError:
             print("Invalid command format. Use 'coin1', 'coin5', or 'coin10'.")
-        return
+        return "invalid"
     
     # Handle numeric input for manual credits
     if command.isdigit():
         value = int(command)
         credit += value
+        save_state()
         update_lcd()
         print(f"Added {value} pesos. Current credit: {credit}")
-        return
+        return "credited"
     
     # Handle napkin selection commands
-    if command.lower() == "nap-1" and credit >= 10 and not dispensing:
-        dispense_wings()
-    elif command.lower() == "nap-2" and credit >= 10 and not dispensing:
-        dispense_regular()
+    if command.lower() == "nap-1" and credit >= PRICE and not dispensing:
+        return "dispensed" if dispense_wings() else "refunded"
+    elif command.lower() == "nap-2" and credit >= PRICE and not dispensing:
+        return "dispensed" if dispense_regular() else "refunded"
     else:
         print("Invalid input. Use number to add credit or 'nap-1'/'nap-2' to select napkin type.")
+        return "invalid"
+
+def get_state():
+    """Snapshot of the machine state for socket clients"""
+    return {
+        "credit": credit,
+        "dispensing": dispensing,
+        "coin_open": coin_open,
+        "pending_pulses": coin_pulse_count,
+    }
+
+def reload_config_if_idle():
+    """Apply a requested settings reload when no command, coin or vend is in progress"""
+    if not config_reloader.pending or not command_lock.acquire(blocking=False):
+        return
+    try:
+        # Holding pulse_lock makes the coin callback wait (not drop) pulses during the swap
+        with pulse_lock:
+            config_reloader.poll(idle=coin_pulse_count == 0 and not dispensing)
+    finally:
+        command_lock.release()
 
 def input_thread_function():
     """Thread function to handle user input"""
     while True:
         try:
             command = input()
-            process_command(command)
+            with command_lock:
+                process_command(command)
         except EOFError:
             break
         except Exception as e:
@@ -334,7 +441,15 @@ def input_thread_function():
 
 def main():
     """Main function"""
+    command_server = None
+    initialize()
     try:
+        # Restore credit from before the last restart
+        restore_state()
+        
+        # Reload settings on SIGHUP (systemctl reload vendo)
+        config_reloader.install_signal_handler()
+        
         # Setup hardware
         setup()
         
@@ -342,19 +457,49 @@ def main():
         input_thread = threading.Thread(target=input_thread_function, daemon=True)
         input_thread.start()
         
+        # Start the command socket for scripted control
+        command_server = CommandSocketServer(COMMAND_SOCKET, process_command, get_state, command_lock)
+        command_server.start()
+        print(f"Command socket listening on {COMMAND_SOCKET}")
+        
         # Main loop
-        while True:
-            # Check physical buttons
-            if GPIO.input(BUTTON_WINGS) == GPIO.LOW and credit >= 10 and not dispensing:
-                dispense_wings()
-                time.sleep(0.3)  # Debounce
+        loop_monitor.start()
+        # systemd watchdog pings only while the main loop keeps to its budget
+        sdnotify.start_watchdog(loop_monitor.healthy)
+        sd_ready = False
+        while running:
+            loop_monitor.tick()
+            
+            # Buttons and coins change credit like console and socket commands, so they take the
+            # same lock; while a command runs they wait for a later iteration (pulses keep counting)
+            pressed = False
+            if command_lock.acquire(blocking=False):
+                try:
+                    # Check physical buttons; a vend is an expected wait, not a stalled loop
+                    if GPIO.input(BUTTON_WINGS) == GPIO.LOW and credit >= PRICE and not dispensing:
+                        with loop_monitor.expected_wait(VEND_TIME_LIMIT):
+                            dispense_wings()
+                        pressed = True
+                    elif GPIO.input(BUTTON_REGULAR) == GPIO.LOW and credit >= PRICE and not dispensing:
+                        with loop_monitor.expected_wait(VEND_TIME_LIMIT):
+                            dispense_regular()
+                        pressed = True
+                    
+                    # Process any coin slot pulses
+                    handle_coin_slot()
+                finally:
+                    command_lock.release()
+            if pressed:
+                with loop_monitor.expected_wait(0.3):
+                    time.sleep(0.3)  # Debounce
             
-            if GPIO.input(BUTTON_REGULAR) == GPIO.LOW and credit >= 10 and not dispensing:
-                dispense_regular()
-                time.sleep(0.3)  # Debounce
+            # Swap in reloaded settings between coins and vends only
+            reload_config_if_idle()
             
-            # Process any coin slot pulses
-            handle_coin_slot()
+            # Tell systemd we are up once the loop is processing coins
+            if not sd_ready:
+                sdnotify.notify("READY=1\nSTATUS=Accepting coins")
+                sd_ready = True
             
             # Small delay to prevent CPU hogging
             time.sleep(0.05)
@@ -362,6 +507,10 @@ def main():
     except KeyboardInterrupt:
         print("\nExiting program")
     finally:
+        sdnotify.notify("STOPPING=1")
+        if command_server:
+            command_server.server_close()
+        state_store.close()
         # Clean up GPIO
         GPIO.cleanup()
 